@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from helpers import scan_directory, sort_and_filter_extensions
+from result_cache import ResultCache
+
+
+def _apply_operation(operation, file_path, params, cache):
+    """
+    Run in a worker process. Catch all exceptions, so one broken file does not abort the whole batch.
+    """
+    try:
+        if cache is not None:
+            return cache.run(operation, file_path, **params), None
+        return operation(file_path, **params), None
+    except Exception as error:
+        return None, '{}: {}'.format(type(error).__name__, error)
+
+
+def _apply_operation_chunk(operation, file_paths, params, cache_directory):
+    cache = ResultCache(cache_directory) if cache_directory is not None else None
+    return [_apply_operation(operation, file_path, params, cache) for file_path in file_paths]
+
+
+def _split_in_chunks(file_paths, chunk_size):
+    return [file_paths[index:index + chunk_size] for index in range(0, len(file_paths), chunk_size)]
+
+
+def run_batch(
+    operation,
+    file_paths: list = None,
+    directory_path: str = None,
+    allowed_extensions: list = None,
+    max_workers: int = None,
+    chunk_size: int = 16,
+    cache_directory: str = None,
+    **params
+):
+    """
+    Apply a single file operation (like resize_image or apply_filter from image_operations.py) to many files,
+    spread over a pool of worker processes. The 'params' are passed on to every call of the operation.
+
+    Provide either a list of 'file_paths', or a 'directory_path' (all files in that directory will be used,
+    optionally only the ones with an extension in 'allowed_extensions'). Sub directories are skipped.
+
+    The files are sent to the workers in chunks of 'chunk_size' files, this keeps the overhead of passing
+    work to other processes small for fast operations on small images. The results are collected in the same order
+    as the (sorted) input, no matter which worker finishes first.
+
+    With a 'cache_directory', the results are stored in a ResultCache, and files that were processed before with the
+    same parameters are copied from the cache instead (see result_cache.py).
+
+    Return a tuple (new_file_paths, errors):
+    - new_file_paths: the paths that the operation returned, in input order (None when the operation failed or
+      returned nothing, like resize_image with invalid dimensions)
+    - errors: a dictionary {file_path: error message} for all files that raised an exception
+    """
+    if file_paths is None:
+        if directory_path is None:
+            raise ValueError('Provide file_paths or a directory_path')
+        file_paths = [
+            entry.path for entry in scan_directory(directory_path=directory_path, include_directories=False)
+        ]
+
+    file_paths = sort_and_filter_extensions(file_paths, allowed_extensions=allowed_extensions)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    chunks = _split_in_chunks(file_paths, chunk_size=max(1, chunk_size))
+
+    new_file_paths = []
+    errors = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map yields the results in the order of the chunks
+        chunk_results = executor.map(
+            _apply_operation_chunk, [operation] * len(chunks), chunks, [params] * len(chunks),
+            [cache_directory] * len(chunks))
+
+        for chunk, results in zip(chunks, chunk_results):
+            for file_path, (new_file_path, error) in zip(chunk, results):
+                new_file_paths.append(new_file_path)
+                if error is not None:
+                    errors[file_path] = error
+
+    return new_file_paths, errors
@@ -0,0 +1,499 @@
+"""
+Benchmarks for the operations in image_operations.py, file_operations.py and video_operations.py.
+
+All inputs are generated (deterministic, so runs on different machines or versions can be compared), in a work
+directory that is kept between runs, so the inputs are only generated once.
+
+Every benchmark runs in a new process, so the peak memory (RSS) is that of the benchmark only. For every run, the
+wall time, the cpu time (including child processes like ffmpeg), the peak RSS and the bytes read and written
+(from /proc/self/io, Linux only) are measured.
+
+Usage:
+    python benchmarks.py run results.json
+    python benchmarks.py run results.json --sizes small,medium,large --file-counts 10000,100000,1000000
+    python benchmarks.py run results.json --filter resize_image
+    python benchmarks.py compare old_results.json new_results.json --threshold 0.1
+
+Compare exits with status 1 when any benchmark got slower (or used more memory) by more than the threshold.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+from time import perf_counter, strftime
+
+import numpy
+import PIL
+from PIL import Image
+
+import file_operations
+import image_operations
+import video_operations
+
+IMAGE_SIZES = {
+    'small': (640, 480),
+    'medium': (1920, 1080),
+    'large': (6000, 4000),
+}
+IMAGE_MODES = {'RGB': 'jpeg', 'L': 'jpeg', 'RGBA': 'png'}
+NUMBER_OF_FRAMES = 60
+FRAME_SIZE = (640, 360)
+COMPARED_METRICS = ('wall_seconds', 'cpu_seconds', 'peak_rss_bytes')
+
+
+def _make_image(file_path: str, size: tuple, mode: str, seed: int = 0):
+    """
+    A gradient with some noise and a few shapes, so filters, hashes and compression have something to work with.
+    """
+    width, height = size
+    random_generator = numpy.random.default_rng(seed)
+    x = numpy.linspace(0, 255, width, dtype=numpy.float32)
+    y = numpy.linspace(0, 255, height, dtype=numpy.float32)[:, numpy.newaxis]
+    pixels = numpy.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2)
+    pixels += random_generator.normal(0, 12, size=pixels.shape).astype(numpy.float32)
+    block = (slice(height // 4, height // 2), slice(width // 4, width // 2))
+    pixels[block] = 255 - pixels[block]
+
+    image = Image.fromarray(numpy.clip(pixels, 0, 255).astype(numpy.uint8), mode='RGB')
+    image.convert(mode).save(file_path)
+
+
+class Inputs:
+    """
+    The generated input files, in 'inputs' in the work directory. Every input is made the first time it is needed.
+    """
+    def __init__(self, work_directory: str):
+        self.directory = os.path.join(work_directory, 'inputs')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def image(self, size_name: str, mode: str):
+        file_path = os.path.join(self.directory, '{}_{}.{}'.format(size_name, mode, IMAGE_MODES[mode]))
+        if not os.path.exists(file_path):
+            _make_image(file_path, size=IMAGE_SIZES[size_name], mode=mode)
+        return file_path
+
+    def frames(self):
+        directory_path = os.path.join(self.directory, 'frames')
+        if not os.path.exists(directory_path):
+            os.mkdir(directory_path)
+            for index in range(NUMBER_OF_FRAMES):
+                _make_image(os.path.join(directory_path, 'frame{:04}.jpeg'.format(index)), FRAME_SIZE, 'RGB', index)
+        return directory_path
+
+    def small_files(self, count: int):
+        """
+        'count' files of 64 bytes to 4 kB. One in ten files is a copy of another one, for sort_files_by_size.
+        """
+        directory_path = os.path.join(self.directory, 'small_files_{}'.format(count))
+        if not os.path.exists(directory_path):
+            random_generator = numpy.random.default_rng(count)
+            temporary_directory = '{}.tmp'.format(directory_path)
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+            os.mkdir(temporary_directory)
+            contents = []
+            for index in range(count):
+                if contents and index % 10 == 9:
+                    content = contents[int(random_generator.integers(len(contents)))]
+                else:
+                    content = random_generator.bytes(int(random_generator.integers(64, 4096)))
+                    contents = contents[-1000:] + [content]
+                with open(os.path.join(temporary_directory, 'file{:07}.bin'.format(index)), 'wb') as file:
+                    file.write(content)
+            os.rename(temporary_directory, directory_path)
+        return directory_path
+
+    def videos(self):
+        directory_path = os.path.join(self.directory, 'videos')
+        if not os.path.exists(directory_path):
+            os.mkdir(directory_path)
+            frames_directory = self.frames()
+            for index in range(2):
+                frame_paths = sorted(os.listdir(frames_directory))[index::2]
+                video_operations.write_movie_from_frames(
+                    (Image.open(os.path.join(frames_directory, name)) for name in frame_paths),
+                    video_path=os.path.join(directory_path, 'video{}.mp4'.format(index)))
+        return directory_path
+
+
+def _link_file(file_path: str, run_directory: str):
+    """
+    Put the input in the run directory, as a hardlink (fast, also for a million files). Operations that change or
+    delete a file only change the link in the run directory, not the input.
+    """
+    new_file_path = os.path.join(run_directory, os.path.basename(file_path))
+    try:
+        os.link(file_path, new_file_path)
+    except OSError:
+        shutil.copy2(file_path, new_file_path)
+    return new_file_path
+
+
+def _link_directory(directory_path: str, run_directory: str):
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            _link_file(entry.path, run_directory)
+    return run_directory
+
+
+class Benchmark:
+    """
+    'prepare(inputs, run_directory)' puts the inputs in the (empty) run directory and returns the arguments for
+    'operation'. Only the call of the operation is measured. 'params' are passed to the operation as well.
+    """
+    def __init__(self, name: str, operation, prepare, requires: tuple = (), **params):
+        self.name = name
+        self.operation = operation
+        self.prepare = prepare
+        self.requires = requires
+        self.params = params
+
+
+def _one_image(size_name, mode):
+    def prepare(inputs, run_directory):
+        return {'file_path': _link_file(inputs.image(size_name, mode), run_directory)}
+    return prepare
+
+
+def _two_images(size_name, mode):
+    def prepare(inputs, run_directory):
+        file_path = _link_file(inputs.image(size_name, mode), run_directory)
+        return {'file_paths': [file_path, shutil.copy(file_path, os.path.join(run_directory, 'copy.{}'.format(
+            IMAGE_MODES[mode])))]}
+    return prepare
+
+
+def _prepare_frames(inputs, run_directory):
+    return {'directory_path': _link_directory(inputs.frames(), run_directory)}
+
+
+def _prepare_wall_frames(inputs, run_directory):
+    # the width of a wall is limited, 12 frames fit
+    file_paths = sorted(os.listdir(_link_directory(inputs.frames(), run_directory)))[:12]
+    return {'file_paths': [os.path.join(run_directory, name) for name in file_paths]}
+
+
+def _small_files(count):
+    def prepare(inputs, run_directory):
+        return {'directory_path': _link_directory(inputs.small_files(count), run_directory)}
+    return prepare
+
+
+def _small_file_paths(count):
+    def prepare(inputs, run_directory):
+        _link_directory(inputs.small_files(count), run_directory)
+        return {'file_paths': sorted(os.path.join(run_directory, name) for name in os.listdir(run_directory))}
+    return prepare
+
+
+def _prepare_videos(inputs, run_directory):
+    return {'file_paths': sorted(
+        os.path.join(run_directory, name) for name in os.listdir(_link_directory(inputs.videos(), run_directory)))}
+
+
+def _prepare_generated_frames(inputs, run_directory):
+    return {'video_path': os.path.join(run_directory, 'generated.mp4')}
+
+
+def _generate_frames(video_path: str):
+    """
+    write_movie_from_frames, with frames that are made in Python (a moving gradient).
+    """
+    width, height = FRAME_SIZE
+
+    def frames():
+        x = numpy.arange(width, dtype=numpy.uint16)
+        for index in range(NUMBER_OF_FRAMES):
+            row = ((x + index * 4) % 256).astype(numpy.uint8)
+            yield numpy.repeat(numpy.broadcast_to(row, (height, width))[:, :, numpy.newaxis], 3, axis=2).tobytes()
+
+    video_operations.write_movie_from_frames(frames(), video_path=video_path, frame_size=FRAME_SIZE)
+
+
+def _for_every_file(file_paths: list, file_operation, **params):
+    """
+    Nautilus calls operations like prefix_filename once for every selected file, do the same.
+    """
+    for file_path in file_paths:
+        file_operation(file_path, **params)
+
+
+def _duplicate_first_file(file_paths: list, number_of_duplicates: int):
+    file_operations.duplicate_file(file_paths[0], number_of_duplicates=number_of_duplicates)
+
+
+def get_benchmarks(size_names: list, file_counts: list):
+    benchmarks = []
+
+    # (label, operation, the image modes the operation supports, params)
+    all_modes, color_modes = ('RGB', 'L', 'RGBA'), ('RGB', 'RGBA')
+    single_image_operations = [
+        ('resize_image', image_operations.resize_image, all_modes, {'new_width': 800, 'new_height': 0}),
+        ('add_margin', image_operations.add_margin, color_modes, {}),
+        ('crop_image_in_equal_parts', image_operations.crop_image_in_equal_parts, all_modes, {'x': 2, 'y': 2}),
+        ('paste_image_in_center', image_operations.paste_image_in_center, color_modes, {}),
+        ('crop_center', image_operations.crop_center, all_modes, {'new_width': 400, 'new_height': 300}),
+        ('apply_filter', image_operations.apply_filter, all_modes, {'filter_name': 'BLUR'}),
+        ('save_image_tags', image_operations.save_image_tags, ('RGB', 'L'), {'artist': 'benchmark'}),
+        ('blur_edges', image_operations.blur_edges, color_modes, {}),
+        ('rotate_image_90', image_operations.rotate_image, color_modes, {'angle_in_degrees': 90.0}),
+        ('rotate_image_30', image_operations.rotate_image, color_modes, {'angle_in_degrees': 30.0}),
+        ('flip_image', image_operations.flip_image, all_modes, {}),
+        ('grayscale', image_operations.grayscale, all_modes, {}),
+        ('color_grayscale', image_operations.color_grayscale, ('L',), {'color_1': (80, 0, 0)}),
+        ('solarize', image_operations.solarize, ('RGB', 'L'), {}),
+        ('image_difference', image_operations.image_difference, all_modes, {}),
+        ('put_images_on_wall', image_operations.put_images_on_wall, color_modes, {}),
+    ]
+    for size_name in size_names:
+        for label, operation, modes, params in single_image_operations:
+            for mode in modes:
+                prepare = _two_images if label in ('image_difference', 'put_images_on_wall') else _one_image
+                benchmarks.append(Benchmark(
+                    '{}[{}-{}]'.format(label, size_name, mode), operation, prepare(size_name, mode), **params))
+
+    benchmarks += [
+        Benchmark('put_images_on_wall[frames]', image_operations.put_images_on_wall, _prepare_wall_frames),
+        Benchmark('make_contact_sheet[frames]', image_operations.make_contact_sheet, _prepare_frames),
+        Benchmark('save_image_tags_in_directory[frames]', image_operations.save_image_tags_in_directory,
+                  _prepare_frames, artist='benchmark'),
+        Benchmark('make_movie[frames]', video_operations.make_movie, _prepare_frames, requires=('ffmpeg',)),
+        Benchmark('make_movie[frames-reverse]', video_operations.make_movie, _prepare_frames,
+                  requires=('ffmpeg',), reverse=True),
+        Benchmark('make_slideshow[frames]', video_operations.make_slideshow, _prepare_frames,
+                  requires=('ffmpeg',), seconds_per_frame=1),
+        Benchmark('write_movie_from_frames[generated]', _generate_frames, _prepare_generated_frames,
+                  requires=('ffmpeg',)),
+        Benchmark('merge_videos[2]', video_operations.merge_videos, _prepare_videos, requires=('ffmpeg',)),
+    ]
+
+    for count in file_counts:
+        benchmarks += [
+            Benchmark('prefix_filename[{}]'.format(count), _for_every_file, _small_file_paths(count),
+                      file_operation=file_operations.prefix_filename),
+            Benchmark('postfix_filename[{}]'.format(count), _for_every_file, _small_file_paths(count),
+                      file_operation=file_operations.postfix_filename),
+            Benchmark('make_filename_unrecognizable[{}]'.format(count), _for_every_file, _small_file_paths(count),
+                      file_operation=file_operations.make_filename_unrecognizable),
+            Benchmark('split_large_folder[{}]'.format(count), file_operations.split_large_folder,
+                      _small_files(count)),
+            Benchmark('weed_out_files[{}]'.format(count), file_operations.weed_out_files, _small_files(count)),
+            Benchmark('number_filenames[{}]'.format(count), file_operations.number_filenames,
+                      _small_file_paths(count)),
+            Benchmark('sort_files_by_size[{}]'.format(count), file_operations.sort_files_by_size,
+                      _small_files(count)),
+            Benchmark('duplicate_file[{}]'.format(count), _duplicate_first_file, _small_file_paths(count),
+                      number_of_duplicates=count),
+        ]
+
+    return benchmarks
+
+
+def _read_proc_io():
+    """
+    rchar and wchar count all bytes read and written with system calls (also from the page cache),
+    read_bytes and write_bytes only what actually went to the storage device.
+    """
+    try:
+        with open('/proc/self/io') as io_file:
+            return {key: int(value) for key, value in (line.split(': ') for line in io_file)}
+    except OSError:
+        return {}
+
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _measure(operation, arguments: dict, connection):
+    """
+    Run in a new process: call the operation once, and send the measurements back.
+    """
+    io_before = _read_proc_io()
+    cpu_before = _cpu_seconds()
+    start = perf_counter()
+
+    error = None
+    try:
+        operation(**arguments)
+    except Exception as exception:
+        error = '{}: {}'.format(type(exception).__name__, exception)
+
+    wall_seconds = perf_counter() - start
+    cpu_seconds = _cpu_seconds() - cpu_before
+    io_after = _read_proc_io()
+
+    connection.send({
+        'wall_seconds': wall_seconds,
+        'cpu_seconds': cpu_seconds,
+        # ru_maxrss is in kilobytes on Linux. ffmpeg and worker processes are children
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'peak_rss_children_bytes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+        'bytes_read': io_after.get('rchar', 0) - io_before.get('rchar', 0),
+        'bytes_written': io_after.get('wchar', 0) - io_before.get('wchar', 0),
+        'storage_bytes_read': io_after.get('read_bytes', 0) - io_before.get('read_bytes', 0),
+        'storage_bytes_written': io_after.get('write_bytes', 0) - io_before.get('write_bytes', 0),
+        'error': error,
+    })
+    connection.close()
+
+
+def _run_once(benchmark: Benchmark, inputs: Inputs, work_directory: str):
+    run_directory = tempfile.mkdtemp(prefix='run_', dir=work_directory)
+    try:
+        arguments = benchmark.prepare(inputs, run_directory)
+
+        # spawn (not fork), so the process does not inherit the memory of this one
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_measure, args=(benchmark.operation, dict(arguments, **benchmark.params), sender))
+        process.start()
+        sender.close()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = {'error': 'The benchmark process stopped with exit code {}'.format(process.exitcode)}
+        process.join()
+        return result
+    finally:
+        shutil.rmtree(run_directory, ignore_errors=True)
+
+
+def _summarize(runs: list):
+    """
+    The fastest run is the least disturbed by other processes, so use the minimum for the times.
+    """
+    if any(run['error'] for run in runs):
+        return {'error': next(run['error'] for run in runs if run['error']), 'runs': runs}
+
+    return {
+        'wall_seconds': min(run['wall_seconds'] for run in runs),
+        'cpu_seconds': min(run['cpu_seconds'] for run in runs),
+        'peak_rss_bytes': max(run['peak_rss_bytes'] for run in runs),
+        'peak_rss_children_bytes': max(run['peak_rss_children_bytes'] for run in runs),
+        'bytes_read': runs[-1]['bytes_read'],
+        'bytes_written': runs[-1]['bytes_written'],
+        'runs': runs,
+    }
+
+
+def run_benchmarks(
+    output_path: str,
+    work_directory: str = None,
+    size_names: list = ('small', 'medium'),
+    file_counts: list = (10000,),
+    repeat: int = 3,
+    name_filter: str = None,
+):
+    work_directory = work_directory or os.path.join(tempfile.gettempdir(), 'python_file_operations_benchmarks')
+    os.makedirs(work_directory, exist_ok=True)
+    inputs = Inputs(work_directory)
+    available_programs = {program for program in ('ffmpeg',) if shutil.which(program)}
+
+    results = {
+        'environment': {
+            'date': strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'ffmpeg': shutil.which('ffmpeg'),
+        },
+        'benchmarks': {},
+    }
+
+    for benchmark in get_benchmarks(size_names=size_names, file_counts=file_counts):
+        if name_filter and name_filter not in benchmark.name:
+            continue
+
+        missing_programs = set(benchmark.requires) - available_programs
+        if missing_programs:
+            results['benchmarks'][benchmark.name] = {'skipped': '{} not installed'.format(', '.join(missing_programs))}
+            print('{:<60} skipped'.format(benchmark.name))
+            continue
+
+        summary = _summarize([_run_once(benchmark, inputs, work_directory) for _ in range(repeat)])
+        results['benchmarks'][benchmark.name] = summary
+        if 'error' in summary:
+            print('{:<60} {}'.format(benchmark.name, summary['error']))
+        else:
+            print('{:<60} {:8.3f} s wall {:8.3f} s cpu {:8.1f} MB'.format(
+                benchmark.name, summary['wall_seconds'], summary['cpu_seconds'], summary['peak_rss_bytes'] / 1e6))
+
+    with open(output_path, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+
+    return results
+
+
+def compare_results(old_path: str, new_path: str, threshold: float = 0.1):
+    """
+    Print the relative change of every metric, and return a list of (name, metric, old, new) of the regressions:
+    the metrics that are more than 'threshold' (0.1 is 10 %) higher in the new results.
+    """
+    with open(old_path) as old_file:
+        old_benchmarks = json.load(old_file)['benchmarks']
+    with open(new_path) as new_file:
+        new_benchmarks = json.load(new_file)['benchmarks']
+
+    regressions = []
+    for name in sorted(set(old_benchmarks) & set(new_benchmarks)):
+        old, new = old_benchmarks[name], new_benchmarks[name]
+        if any(key in summary for summary in (old, new) for key in ('skipped', 'error')):
+            continue
+
+        changes = []
+        for metric in COMPARED_METRICS:
+            change = (new[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            changes.append('{} {:+7.1%}'.format(metric, change))
+            if change > threshold:
+                regressions.append((name, metric, old[metric], new[metric]))
+        print('{:<60} {}'.format(name, '  '.join(changes)))
+
+    for name, metric, old, new in regressions:
+        print('REGRESSION {} {}: {:.4g} -> {:.4g}'.format(name, metric, old, new))
+
+    return regressions
+
+
+def main(arguments: list = None):
+    parser = argparse.ArgumentParser(description='Benchmark the file, image and video operations')
+    sub_parsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub_parsers.add_parser('run', help='run the benchmarks and save the results as json')
+    run_parser.add_argument('output_path')
+    run_parser.add_argument('--work-directory', help='where the inputs are generated (kept between runs)')
+    run_parser.add_argument('--sizes', default='small,medium', help='image sizes: {}'.format(', '.join(IMAGE_SIZES)))
+    run_parser.add_argument('--file-counts', default='10000', help='numbers of files for the file operations')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--filter', help='only run benchmarks with this text in their name')
+
+    compare_parser = sub_parsers.add_parser('compare', help='compare two results, exit with 1 on regressions')
+    compare_parser.add_argument('old_path')
+    compare_parser.add_argument('new_path')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+
+    arguments = parser.parse_args(arguments)
+    if arguments.command == 'run':
+        run_benchmarks(
+            arguments.output_path,
+            work_directory=arguments.work_directory,
+            size_names=arguments.sizes.split(','),
+            file_counts=[int(count) for count in arguments.file_counts.split(',')],
+            repeat=arguments.repeat,
+            name_filter=arguments.filter,
+        )
+    elif compare_results(arguments.old_path, arguments.new_path, threshold=arguments.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
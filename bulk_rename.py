@@ -0,0 +1,189 @@
+import ctypes
+import errno
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _renameat2 = _libc.renameat2
+    _renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+except (OSError, AttributeError):
+    _renameat2 = None  # not Linux, or a C library without renameat2
+
+
+def rename_no_replace(src: str, dst: str):
+    """
+    Rename, but never overwrite an existing file (os.rename silently replaces it on Linux).
+
+    On Linux, renameat2 with RENAME_NOREPLACE does the check and the rename in one atomic step. When that is not
+    available (other systems, or a file system that does not support the flag), check first and then rename.
+    """
+    if _renameat2 is not None:
+        if _renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dst), RENAME_NOREPLACE) == 0:
+            return
+
+        error_number = ctypes.get_errno()
+        if error_number not in (errno.EINVAL, errno.ENOSYS):
+            raise OSError(error_number, os.strerror(error_number), src, None, dst)
+
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), src, None, dst)
+    os.rename(src, dst)
+
+
+def _get_temporary_path(file_path: str):
+    # in the same directory, so the rename stays on the same file system
+    directory, file_name = os.path.split(file_path)
+    return os.path.join(directory, '.{}.{}.renaming'.format(file_name, uuid.uuid4().hex[:8]))
+
+
+def plan_renames(renames: list):
+    """
+    Take a list of (src, dst) tuples, check the complete plan before anything is renamed, and return a list of
+    (src, temporary_path, dst) tuples. Renames where src equals dst are left out.
+
+    Raise a ValueError when two files are renamed to the same name (or the same file twice), a FileNotFoundError
+    for a missing source, and a FileExistsError when a destination exists and is not renamed itself.
+
+    A destination can be the source of another rename, like in a chain (a -> b, b -> c) or a cycle (a -> b, b -> a).
+    Those sources get a temporary path: they are moved out of the way in the first phase.
+    All other renames have None as temporary_path and go directly to their destination.
+    """
+    renames = [(os.path.normpath(src), os.path.normpath(dst)) for src, dst in renames]
+    renames = [(src, dst) for src, dst in renames if src != dst]
+
+    sources = set()
+    destinations = set()
+    for src, dst in renames:
+        if src in sources:
+            raise ValueError('{} is renamed more than once'.format(src))
+        if dst in destinations:
+            raise ValueError('More than one file would be renamed to {}'.format(dst))
+        sources.add(src)
+        destinations.add(dst)
+
+    plan = []
+    for src, dst in renames:
+        if not os.path.lexists(src):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), src)
+        if os.path.lexists(dst) and dst not in sources:
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+
+        plan.append((src, _get_temporary_path(src) if src in destinations else None, dst))
+
+    return plan
+
+
+class _Journal:
+    """
+    Every rename is logged (json lines) right after it happened, so after a crash the journal tells where every
+    file is. The first line contains the full plan.
+    """
+    def __init__(self, journal_path: str, plan: list):
+        self.journal_path = journal_path
+        self.lock = threading.Lock()
+        self.file = open(journal_path, 'w')
+        self.write({'plan': plan})
+
+    def write(self, data: dict):
+        with self.lock:
+            self.file.write('{}\n'.format(json.dumps(data)))
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def _run_phase(steps: list, journal: _Journal, phase: int, max_workers: int):
+    def rename(step):
+        index, src, dst = step
+        rename_no_replace(src, dst)
+        journal.write({'phase': phase, 'index': index})
+
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(rename, steps))
+    else:
+        for step in steps:
+            rename(step)
+
+
+def execute_rename_plan(plan: list, journal_path: str, max_workers: int = 1, keep_journal: bool = False):
+    """
+    Execute a plan from plan_renames in two phases:
+    1. move the sources that are also a destination to their temporary path
+    2. rename all files to their destination
+
+    Before anything is renamed, the journal is written to 'journal_path'. When something fails, the journal stays,
+    and undo_renames(journal_path) moves every file back to its original name.
+
+    On network file systems a single rename can take milliseconds, use 'max_workers' to rename in a thread pool.
+    The renames within one phase do not depend on each other, so their order does not matter.
+    """
+    journal = _Journal(journal_path, plan)
+    try:
+        _run_phase(
+            [(index, src, temporary_path) for index, (src, temporary_path, dst) in enumerate(plan) if temporary_path],
+            journal=journal, phase=1, max_workers=max_workers,
+        )
+        _run_phase(
+            [(index, temporary_path or src, dst) for index, (src, temporary_path, dst) in enumerate(plan)],
+            journal=journal, phase=2, max_workers=max_workers,
+        )
+    except Exception as error:
+        raise OSError('Renaming failed ({}), use undo_renames(\'{}\') to restore the original names'.format(
+            error, journal_path)) from error
+    finally:
+        journal.close()
+
+    if not keep_journal:
+        os.unlink(journal_path)
+
+
+def bulk_rename(renames: list, max_workers: int = 1, keep_journal: bool = False):
+    """
+    Rename many files at once, like: bulk_rename([(src, dst), (src, dst), ...])
+    The plan is checked completely before the first file is renamed (see plan_renames), and executed with a journal,
+    so it can be undone (see execute_rename_plan). The journal is a hidden file in the directory of the first file.
+
+    Return the path of the journal when 'keep_journal' is set.
+    """
+    plan = plan_renames(renames)
+    if not plan:
+        return
+
+    journal_path = os.path.join(
+        os.path.dirname(plan[0][0]), '.rename_journal_{}.jsonl'.format(str(time()).replace('.', '_')))
+    execute_rename_plan(plan, journal_path=journal_path, max_workers=max_workers, keep_journal=keep_journal)
+
+    if keep_journal:
+        return journal_path
+
+
+def undo_renames(journal_path: str, max_workers: int = 1):
+    """
+    Read the journal of an (interrupted or finished) bulk rename, and move every file back to its original name.
+    """
+    with open(journal_path) as journal_file:
+        lines = [json.loads(line) for line in journal_file if line.strip()]
+
+    plan = lines[0]['plan']
+    completed_phases = {(line['phase'], line['index']) for line in lines[1:]}
+
+    renames = []
+    for index, (src, temporary_path, dst) in enumerate(plan):
+        if (2, index) in completed_phases:
+            renames.append((dst, src))
+        elif (1, index) in completed_phases:
+            renames.append((temporary_path, src))
+
+    # the way back can contain chains and cycles as well, so it is a new plan
+    bulk_rename(renames, max_workers=max_workers)
+    os.unlink(journal_path)
@@ -0,0 +1,310 @@
+"""
+One command line entry point for all operations in file_operations.py, image_operations.py and video_operations.py.
+
+The operations are found by reading the source of those modules (with ast), not by importing them. A module is
+only imported when one of its operations runs, so a file operation does not import Pillow, piexif or numpy.
+
+Usage:
+    python cli.py list
+    python cli.py resize_image --help
+    python cli.py resize_image photo1.jpeg photo2.jpeg --new-width 2000 --new-height 0
+    python cli.py add_margin photo.jpeg --margin 50 --background-color 255,255,255
+    python cli.py manifest jobs.txt
+
+Every operation takes a file_path (it is called for every path), a list of file_paths (it is called once, with all
+paths) or a directory_path (it is called for every path).
+
+A manifest lists many jobs, that all run in one process. As plain text, one job per line:
+    resize_image /path/to/image.jpeg new_width=2000 new_height=0
+    image_difference /path/to/image1.jpeg /path/to/image2.jpeg
+    # lines starting with # and empty lines are skipped, use quotes for paths with spaces
+Or as json (a file that ends with .json):
+    [{"operation": "resize_image", "paths": ["/path/to/image.jpeg"], "params": {"new_width": 2000}}, ...]
+"""
+import argparse
+import ast
+import importlib
+import json
+import os
+import shlex
+import sys
+import traceback
+
+OPERATION_MODULES = ('file_operations', 'image_operations', 'video_operations')
+INPUT_PARAMETERS = ('file_path', 'file_paths', 'directory_path')
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'n', 'off')
+
+
+class Operation:
+    """
+    Everything the command line needs to know about an operation, read from the source of its module.
+    """
+    def __init__(self, name: str, module_name: str, input_parameter: str, parameters: dict, description: str):
+        self.name = name
+        self.module_name = module_name
+        self.input_parameter = input_parameter
+        self.parameters = parameters  # {name: (annotation name, default value)}, in the order of the signature
+        self.description = description
+        self.combo_choices = {}
+        self.color_parameters = ()
+
+    def load(self):
+        return getattr(importlib.import_module(self.module_name), self.name)
+
+
+def _get_constants(tree):
+    """
+    The module level names and class attributes with a literal value, like movie_combo_choices and Colors.black,
+    so defaults and metadata that refer to them can be resolved.
+    """
+    constants = {}
+    for node in tree.body:
+        assignments = [(node, '')]
+        if isinstance(node, ast.ClassDef):
+            assignments = [(child, '{}.'.format(node.name)) for child in node.body]
+
+        for assignment, prefix in assignments:
+            if isinstance(assignment, ast.Assign) and isinstance(assignment.targets[0], ast.Name):
+                try:
+                    constants[prefix + assignment.targets[0].id] = ast.literal_eval(assignment.value)
+                except ValueError:
+                    pass
+    return constants
+
+
+def _dotted_name(node):
+    """
+    'Colors.black' for the node of Colors.black, None for anything that is not a (dotted) name.
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        prefix = _dotted_name(node.value)
+        return '{}.{}'.format(prefix, node.attr) if prefix else None
+
+
+def _evaluate(node, constants: dict):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        # a name like movie_combo_choices, or an attribute like Colors.black
+        return constants.get(_dotted_name(node))
+
+
+def _read_operations(module_name: str):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '{}.py'.format(module_name))) as module_file:
+        tree = ast.parse(module_file.read())
+    constants = _get_constants(tree)
+
+    operations = {}
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and not node.name.startswith('_'):
+            arguments = node.args.args
+            if not arguments or arguments[0].arg not in INPUT_PARAMETERS:
+                continue  # not an operation on files, like calculate_box_tuples
+
+            defaults = [None] * (len(arguments) - len(node.args.defaults)) + node.args.defaults
+            parameters = {
+                argument.arg: (
+                    _dotted_name(argument.annotation) if argument.annotation else None,
+                    _evaluate(default, constants) if default is not None else None,
+                )
+                for argument, default in zip(arguments[1:], defaults[1:])
+            }
+            description = (ast.get_docstring(node) or '').strip()
+            operations[node.name] = Operation(node.name, module_name, arguments[0].arg, parameters, description)
+
+        # operation.combo_choices = {...} and operation.color_parameters = (...)
+        elif isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Attribute):
+            target = node.targets[0]
+            if isinstance(target.value, ast.Name) and target.value.id in operations:
+                if target.attr in ('combo_choices', 'color_parameters'):
+                    setattr(operations[target.value.id], target.attr, _evaluate(node.value, constants) or {})
+
+    return operations
+
+
+def discover_operations():
+    operations = {}
+    for module_name in OPERATION_MODULES:
+        operations.update(_read_operations(module_name))
+    return operations
+
+
+def _parse_color(text: str):
+    """
+    '255,0,0' or '#ff0000'
+    """
+    if text.startswith('#'):
+        return tuple(int(text[index:index + 2], 16) for index in range(1, len(text), 2))
+    return tuple(int(value) for value in text.split(','))
+
+
+def convert_value(operation: Operation, name: str, value):
+    """
+    Convert a value from the command line or a manifest (a string, or a json value) to the type of the parameter.
+    """
+    if name not in operation.parameters:
+        raise ValueError('{} has no parameter {}'.format(operation.name, name))
+    annotation, default = operation.parameters[name]
+
+    if name in operation.color_parameters or annotation == 'tuple':
+        value = _parse_color(value) if isinstance(value, str) else tuple(value)
+    elif isinstance(value, str):
+        if annotation == 'bool' or isinstance(default, bool):
+            if value.lower() not in TRUE_VALUES + FALSE_VALUES:
+                raise ValueError('{} should be true or false, not {}'.format(name, value))
+            value = value.lower() in TRUE_VALUES
+        elif annotation == 'int' or (annotation is None and isinstance(default, int)):
+            value = int(value)
+        elif annotation == 'float' or isinstance(default, float):
+            value = float(value)
+        elif annotation == 'list':
+            value = value.split(',')
+        elif annotation is None and default is None:
+            try:
+                value = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                pass  # just a string
+
+    choices = operation.combo_choices.get(name)
+    if choices and value not in choices:
+        raise ValueError('{} should be one of {}, not {}'.format(name, ', '.join(map(str, choices)), value))
+
+    return value
+
+
+def run_operation(operation: Operation, paths: list, params: dict):
+    """
+    Call the operation for every path (or once, for operations that take a list of file_paths).
+    Return the list of results.
+    """
+    function = operation.load()
+    if operation.input_parameter == 'file_paths':
+        return [function(paths, **params)]
+    return [function(path, **params) for path in paths]
+
+
+def _make_parser(operation: Operation):
+    parser = argparse.ArgumentParser(
+        prog='cli.py {}'.format(operation.name), description=operation.description,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', metavar=operation.input_parameter)
+
+    for name, (annotation, default) in operation.parameters.items():
+        choices = operation.combo_choices.get(name)
+        parser.add_argument(
+            '--{}'.format(name.replace('_', '-')), dest=name, default=argparse.SUPPRESS, metavar=name.upper(),
+            help='{}default: {}{}'.format('{}, '.format(annotation) if annotation else '', default,
+                                          ', one of: {}'.format(', '.join(map(str, choices))) if choices else ''))
+    return parser
+
+
+def _read_manifest(manifest_path: str, operations: dict):
+    """
+    Return a list of (line number or index, operation name, paths, params).
+    In a text manifest, a word is only a parameter when it starts with a parameter name of the operation and '=',
+    other words are paths (so a path like a=b.jpeg works).
+    """
+    with open(manifest_path) as manifest_file:
+        if manifest_path.lower().endswith('.json'):
+            jobs = json.load(manifest_file)
+            return [
+                (index, job['operation'], job.get('paths') or [job['path']], job.get('params', {}))
+                for index, job in enumerate(jobs.get('jobs', []) if isinstance(jobs, dict) else jobs)
+            ]
+
+        jobs = []
+        for line_number, line in enumerate(manifest_file, start=1):
+            if line.lstrip().startswith('#'):
+                continue  # not shlex comments, a color like #ff0000 would be cut off
+            words = shlex.split(line)
+            if not words:
+                continue
+            operation = operations.get(words[0])
+            parameters = operation.parameters if operation is not None else {}
+            paths = []
+            params = {}
+            for word in words[1:]:
+                name, is_param, value = word.partition('=')
+                if is_param and name in parameters:
+                    params[name] = value
+                else:
+                    paths.append(word)
+            jobs.append((line_number, words[0], paths, params))
+        return jobs
+
+
+def run_manifest(manifest_path: str, operations: dict, stop_on_error: bool = False):
+    """
+    Run all jobs in the manifest in this process, and return the number of failed jobs.
+    """
+    jobs = _read_manifest(manifest_path, operations)
+    failed = 0
+    for job_number, (position, operation_name, paths, params) in enumerate(jobs, start=1):
+        try:
+            operation = operations[operation_name]
+            params = {name: convert_value(operation, name, value) for name, value in params.items()}
+            results = run_operation(operation, paths, params)
+            print('[{}/{}] {} {} -> {}'.format(job_number, len(jobs), operation_name, ' '.join(paths), results))
+        except Exception as error:
+            failed += 1
+            if isinstance(error, KeyError) and operation_name not in operations:
+                error = 'Unknown operation {}'.format(operation_name)
+            print('[{}/{}] {} (line {}) failed: {}'.format(
+                job_number, len(jobs), operation_name, position, error), file=sys.stderr)
+            if stop_on_error:
+                break
+
+    print('{} jobs, {} failed'.format(len(jobs), failed))
+    return failed
+
+
+def main(arguments: list = None):
+    arguments = sys.argv[1:] if arguments is None else arguments
+    if not arguments or arguments[0] in ('-h', '--help'):
+        print(__doc__)
+        return 0
+
+    operations = discover_operations()
+    command = arguments[0]
+
+    if command == 'list':
+        for name, operation in sorted(operations.items()):
+            print('{:<32} {:<18} {}'.format(name, operation.module_name, operation.description.split('\n')[0]))
+        return 0
+
+    if command == 'manifest':
+        parser = argparse.ArgumentParser(prog='cli.py manifest')
+        parser.add_argument('manifest_path')
+        parser.add_argument('--stop-on-error', action='store_true')
+        manifest_arguments = parser.parse_args(arguments[1:])
+        return 1 if run_manifest(manifest_arguments.manifest_path, operations,
+                                 stop_on_error=manifest_arguments.stop_on_error) else 0
+
+    if command not in operations:
+        print('Unknown operation {}, see: python cli.py list'.format(command), file=sys.stderr)
+        return 2
+
+    operation = operations[command]
+    parser = _make_parser(operation)
+    parsed = vars(parser.parse_args(arguments[1:]))
+    paths = parsed.pop('paths')
+    try:
+        params = {name: convert_value(operation, name, value) for name, value in parsed.items()}
+    except ValueError as error:
+        parser.error(str(error))
+
+    try:
+        for result in run_operation(operation, paths, params):
+            if result is not None:
+                print(result)
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
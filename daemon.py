@@ -0,0 +1,359 @@
+"""
+A long running process that keeps the operations imported, with a pool of warm worker processes, so an action
+(like a Nautilus script) does not pay for starting Python, importing Pillow and starting workers every time.
+
+Start the daemon (for example when logging in):
+    python daemon.py serve --workers 4
+
+Run an operation, with the same names and values as cli.py. When the daemon is not running, the operation runs in
+the current process instead:
+    python daemon.py resize_image photo1.jpeg photo2.jpeg --new-width 2000 --new-height 0 --priority 10
+
+    python daemon.py status
+    python daemon.py stop
+
+Or from Python: results, errors = submit('resize_image', [file_path], {'new_width': 2000})
+
+Clients send one json request per connection, over a Unix domain socket. The daemon answers with json lines:
+'queued', a 'progress' event for every finished file, and 'done' with all results and errors. While a job runs,
+a 'heartbeat' event is sent every HEARTBEAT_INTERVAL seconds.
+Files are handled in order of the priority of their job (highest first), then in order of arrival.
+"""
+import importlib
+import itertools
+import json
+import os
+import queue
+import socket
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import cli
+
+DEFAULT_SOCKET_PATH = os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(), 'python_file_operations_{}.sock'.format(os.getuid()))
+# seconds without any event from the daemon, before the client gives up
+DEFAULT_CLIENT_TIMEOUT = 600
+# seconds between two 'heartbeat' events while a job runs, so a slow file does not look like a stuck daemon
+HEARTBEAT_INTERVAL = 30
+
+
+def _run_task(module_name: str, operation_name: str, input_parameter: str, paths: list, params: dict):
+    """
+    Run in a worker process (or in the current process, without a daemon). Like run_batch, an exception is
+    returned as an error message, so one broken file does not stop the job.
+    """
+    function = getattr(importlib.import_module(module_name), operation_name)
+    try:
+        if input_parameter == 'file_paths':
+            return function(paths, **params), None
+        return function(paths[0], **params), None
+    except Exception as error:
+        return None, '{}: {}'.format(type(error).__name__, error)
+
+
+def _split_in_tasks(operation, paths: list):
+    # an operation on a list of file_paths is one task, otherwise every path is a task
+    return [paths] if operation.input_parameter == 'file_paths' else [[path] for path in paths]
+
+
+def _send(connection, lock, **event):
+    with lock:
+        try:
+            connection.sendall('{}\n'.format(json.dumps(event)).encode('utf-8'))
+        except OSError:
+            pass  # the client is gone, the job still finishes
+
+
+class _Job:
+    def __init__(self, connection, operation, paths: list, params: dict, priority: int):
+        self.connection = connection
+        self.lock = threading.Lock()
+        self.operation = operation
+        self.params = params
+        self.priority = priority
+        self.tasks = _split_in_tasks(operation, paths)
+        self.results = [None] * len(self.tasks)
+        self.errors = {}
+        self.remaining = len(self.tasks)
+        self.done = threading.Event()
+        if not self.tasks:
+            self.done.set()
+
+    def task_done(self, index: int, result, error):
+        with self.lock:
+            self.results[index] = result
+            if error is not None:
+                self.errors[' '.join(self.tasks[index])] = error
+            self.remaining -= 1
+            remaining = self.remaining
+
+        _send(self.connection, self.lock, event='progress', done=len(self.tasks) - remaining, total=len(self.tasks),
+              paths=self.tasks[index], result=result, error=error)
+        if remaining == 0:
+            _send(self.connection, self.lock, event='done', results=self.results, errors=self.errors)
+            self.done.set()
+
+
+class Daemon:
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, max_workers: int = None):
+        self.socket_path = socket_path
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.operations = cli.discover_operations()
+        self.task_queue = queue.PriorityQueue()  # (-priority, job number, task index, job)
+        self.job_numbers = itertools.count()
+        self.free_workers = threading.Semaphore(self.max_workers)
+        self.stopping = False
+        self.executor = None
+
+    def _dispatch(self):
+        """
+        Give the next task to the pool as soon as a worker is free. The tasks wait in the priority queue (not in the
+        pool), so a job with a high priority goes before the remaining files of a large job.
+        """
+        while True:
+            self.free_workers.acquire()
+            negative_priority, job_number, index, job = self.task_queue.get()
+            operation = job.operation
+            try:
+                future = self.executor.submit(
+                    _run_task, operation.module_name, operation.name, operation.input_parameter, job.tasks[index],
+                    job.params)
+            except BrokenProcessPool as error:
+                # a worker was killed (for example by the OOM killer), the pool can not be used anymore
+                self.free_workers.release()
+                job.task_done(index, None, '{}: {}'.format(type(error).__name__, error))
+                self._replace_executor()
+                continue
+            future.add_done_callback(partial(self._task_done, job, index))
+
+    def _start_executor(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        wait([self.executor.submit(os.getpid) for _ in range(self.max_workers)])  # start all workers now
+
+    def _replace_executor(self):
+        broken_executor = self.executor
+        self._start_executor()
+        broken_executor.shutdown(wait=False)
+
+    def _task_done(self, job: _Job, index: int, future):
+        self.free_workers.release()
+        try:
+            result, error = future.result()
+        except Exception as exception:  # a worker process crashed
+            result, error = None, '{}: {}'.format(type(exception).__name__, exception)
+        job.task_done(index, result, error)
+
+    def _handle(self, connection):
+        lock = threading.Lock()
+        with connection:
+            try:
+                request = json.loads(connection.makefile('rb').readline())
+                command = request.get('command', 'run')
+                if command == 'ping':
+                    _send(connection, lock, event='pong', pid=os.getpid(), queued=self.task_queue.qsize())
+                    return
+                if command == 'stop':
+                    _send(connection, lock, event='stopped')
+                    self.stop()
+                    return
+
+                operation = self.operations[request['operation']]
+                params = {name: cli.convert_value(operation, name, value)
+                          for name, value in request.get('params', {}).items()}
+            except KeyError as error:
+                _send(connection, lock, event='error', message='Unknown operation or missing field {}'.format(error))
+                return
+            except Exception as error:
+                _send(connection, lock, event='error', message='{}: {}'.format(type(error).__name__, error))
+                return
+
+            job = _Job(connection, operation, request.get('paths', []), params, int(request.get('priority', 0)))
+            _send(connection, job.lock, event='queued', tasks=len(job.tasks), waiting=self.task_queue.qsize())
+            if not job.tasks:
+                _send(connection, job.lock, event='done', results=[], errors={})
+
+            job_number = next(self.job_numbers)
+            for index in range(len(job.tasks)):
+                self.task_queue.put((-job.priority, job_number, index, job))
+            while not job.done.wait(HEARTBEAT_INTERVAL):
+                _send(connection, job.lock, event='heartbeat', remaining=job.remaining)
+
+    def stop(self):
+        self.stopping = True
+        # accept() is waiting for a connection, give it one
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as wake_up:
+            try:
+                wake_up.connect(self.socket_path)
+            except OSError:
+                pass
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            if is_running(self.socket_path):
+                raise RuntimeError('A daemon is already running on {}'.format(self.socket_path))
+            os.unlink(self.socket_path)  # left behind by a daemon that did not stop cleanly
+
+        # import everything before the pool is started, so the (forked) workers have it imported as well
+        for module_name in cli.OPERATION_MODULES:
+            importlib.import_module(module_name)
+
+        self._start_executor()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(64)
+        try:
+            while not self.stopping:
+                connection, address = server.accept()
+                if self.stopping:
+                    connection.close()
+                    break
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+        finally:
+            server.close()
+            os.unlink(self.socket_path)
+            self.executor.shutdown(wait=True)
+
+
+def _request(request: dict, socket_path: str, timeout: float = DEFAULT_CLIENT_TIMEOUT):
+    """
+    Send the request, and yield the events of the answer. Raise ConnectionError when there is no daemon, and
+    TimeoutError when the daemon sends nothing for 'timeout' seconds.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        try:
+            connection.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as error:
+            raise ConnectionError('No daemon on {}'.format(socket_path)) from error
+
+        connection.sendall('{}\n'.format(json.dumps(request)).encode('utf-8'))
+        try:
+            for line in connection.makefile('rb'):
+                yield json.loads(line)
+        except socket.timeout as error:
+            raise TimeoutError('No answer from the daemon on {} in {} seconds'.format(
+                socket_path, timeout)) from error
+
+
+def is_running(socket_path: str = DEFAULT_SOCKET_PATH):
+    try:
+        return any(event['event'] == 'pong' for event in _request({'command': 'ping'}, socket_path, timeout=5))
+    except (ConnectionError, TimeoutError):
+        return False
+
+
+def _run_in_process(operation_name: str, paths: list, params: dict, on_event=None):
+    operation = cli.discover_operations()[operation_name]
+    params = {name: cli.convert_value(operation, name, value) for name, value in params.items()}
+
+    tasks = _split_in_tasks(operation, paths)
+    results = []
+    errors = {}
+    for index, task_paths in enumerate(tasks, start=1):
+        result, error = _run_task(operation.module_name, operation.name, operation.input_parameter, task_paths, params)
+        results.append(result)
+        if error is not None:
+            errors[' '.join(task_paths)] = error
+        if on_event is not None:
+            on_event({'event': 'progress', 'done': index, 'total': len(tasks), 'paths': task_paths,
+                      'result': result, 'error': error})
+
+    return results, errors
+
+
+def submit(operation_name: str, paths: list, params: dict = None, priority: int = 0,
+           socket_path: str = DEFAULT_SOCKET_PATH, on_event=None, timeout: float = DEFAULT_CLIENT_TIMEOUT):
+    """
+    Run the operation in the daemon, or in this process when no daemon is running, or when the daemon does not
+    accept the job within 'timeout' seconds. Once the daemon has queued the job, it is never run a second time
+    here: when the daemon then sends nothing for 'timeout' seconds (while it sends a heartbeat every
+    HEARTBEAT_INTERVAL seconds) or the connection is lost, TimeoutError or ConnectionError is raised.
+    'params' can be strings (like on the command line) or values. 'on_event' is called with every event, like
+    {'event': 'progress', 'done': 3, 'total': 10, ...}.
+
+    Return a tuple (results, errors), like run_batch: the results in the order of the paths, and a dictionary
+    {path: error message}.
+    """
+    params = params or {}
+    request = {'operation': operation_name, 'paths': paths, 'params': params, 'priority': priority}
+    queued = False
+    try:
+        for event in _request(request, socket_path, timeout=timeout):
+            queued = queued or event['event'] == 'queued'
+            if on_event is not None:
+                on_event(event)
+            if event['event'] == 'error':
+                raise ValueError(event['message'])
+            if event['event'] == 'done':
+                return event['results'], event['errors']
+    except (ConnectionError, TimeoutError):
+        if queued:
+            raise  # the daemon may still be running the job, running it again could apply it twice
+        return _run_in_process(operation_name, paths, params, on_event=on_event)
+
+    raise ConnectionError('The daemon stopped before the job was done')
+
+
+def _parse_arguments(arguments: list):
+    """
+    'operation path path --name value --name value', without looking up the operation (the daemon does that).
+    """
+    paths = []
+    params = {}
+    words = iter(arguments)
+    for word in words:
+        if word.startswith('--'):
+            params[word[2:].replace('-', '_')] = next(words, '')
+        else:
+            paths.append(word)
+    return paths, params
+
+
+def main(arguments: list = None):
+    arguments = sys.argv[1:] if arguments is None else arguments
+    if not arguments or arguments[0] in ('-h', '--help'):
+        print(__doc__)
+        return 0
+
+    command = arguments[0]
+    paths, params = _parse_arguments(arguments[1:])
+    socket_path = params.pop('socket', DEFAULT_SOCKET_PATH)
+
+    if command == 'serve':
+        workers = params.pop('workers', None)
+        Daemon(socket_path=socket_path, max_workers=int(workers) if workers else None).serve_forever()
+        return 0
+
+    if command in ('status', 'stop'):
+        if not is_running(socket_path):
+            print('Not running')
+            return 1
+        for event in _request({'command': 'ping' if command == 'status' else 'stop'}, socket_path):
+            print(event)
+        return 0
+
+    priority = int(params.pop('priority', 0))
+
+    def print_progress(event):
+        if event['event'] == 'progress':
+            print('[{}/{}] {}'.format(event['done'], event['total'], event['error'] or event['result']))
+
+    try:
+        results, errors = submit(command, paths, params, priority=priority, socket_path=socket_path,
+                                 on_event=print_progress)
+    except (ValueError, KeyError, ConnectionError, TimeoutError) as error:
+        print(error, file=sys.stderr)
+        return 2
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+
+EDGE_SIZE = 4096  # number of bytes that will be hashed at the start and the end of a file in the second stage
+BLOCK_SIZE = 1024 * 1024
+
+
+def _hash_file_edges(file_path: str, edge_size: int = EDGE_SIZE):
+    """
+    Hash only the first and last 'edge_size' bytes. Files of the same size that differ, very often already differ
+    in the header (image dimensions, exif data) or at the end of the file.
+    """
+    file_hash = blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        file_hash.update(file.read(edge_size))
+
+        file_size = os.fstat(file.fileno()).st_size
+        if file_size > edge_size:
+            file.seek(max(edge_size, file_size - edge_size))
+            file_hash.update(file.read(edge_size))
+
+    return file_hash.hexdigest()
+
+
+def hash_file(file_path: str, block_size: int = BLOCK_SIZE):
+    """
+    Return a hash (hex digest) of the full content of the file.
+    """
+    file_hash = blake2b()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def _split_groups(groups, key_function, executor):
+    """
+    Split every group of file paths in smaller groups of file paths with the same key.
+    Groups with only one file path are dropped, those files have no duplicates.
+    """
+    file_paths = [file_path for group in groups for file_path in group]
+    keys = executor.map(key_function, file_paths)
+
+    new_groups = {}
+    for group_index, group in enumerate(groups):
+        for file_path in group:
+            new_groups.setdefault((group_index, next(keys)), []).append(file_path)
+
+    return [group for group in new_groups.values() if len(group) > 1]
+
+
+def find_duplicate_files(file_paths: list, max_workers: int = None):
+    """
+    Find all sets of files with exactly the same content.
+
+    This happens in three stages, every stage only looks at the files that are still possible duplicates:
+    1. group by file size (no file content is read)
+    2. group by a hash of the first and last few KB of the file
+    3. group by a hash of the full file content, this is the only stage where entire files are read.
+    Hashing happens in a pool of threads, hashlib releases the GIL on large buffers, and the reading is I/O bound.
+
+    The file_paths can also be os.DirEntry objects (see helpers.scan_directory), then their cached stat result is used.
+
+    Return a list of duplicate sets (every set is a sorted list of file paths, with at least two paths),
+    sorted by the first file path.
+    """
+    size_groups = {}
+    for file_path in file_paths:
+        if isinstance(file_path, os.DirEntry):
+            file_size = file_path.stat().st_size
+        else:
+            file_size = os.path.getsize(file_path)
+        size_groups.setdefault(file_size, []).append(os.fspath(file_path))
+    groups = [group for group in size_groups.values() if len(group) > 1]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        groups = _split_groups(groups, key_function=_hash_file_edges, executor=executor)
+        groups = _split_groups(groups, key_function=hash_file, executor=executor)
+
+    return sorted(sorted(group) for group in groups)
+
+
+def replace_duplicates_with_hardlinks(duplicate_files: list):
+    """
+    Keep the first file of every duplicate set, and replace all the other files by a hardlink to the first file.
+    The content stays available under every file name, but is stored only once on disk.
+
+    The hardlink is first made under a temporary name, and then moved over the duplicate, so the duplicate file
+    path never disappears (not even when this fails halfway).
+    """
+    for file_paths in duplicate_files:
+        original = file_paths[0]
+        for file_path in file_paths[1:]:
+            if os.path.samefile(original, file_path):
+                continue  # already a hardlink
+
+            temporary_path = '{}.hardlink_tmp'.format(file_path)
+            os.link(original, temporary_path)
+            os.replace(temporary_path, file_path)
@@ -0,0 +1,255 @@
+"""
+Run ffmpeg processes with asyncio, so many encodes can run at the same time (up to a limit), while their input is
+written, their progress is read and their errors are collected.
+
+Usage:
+    run_ffmpeg(['-i', 'input.mov', 'output.mp4'], output_path='output.mp4', on_progress=print)
+
+    # many jobs, at most 'max_jobs' ffmpeg processes at the same time
+    run_ffmpeg_jobs([dict(arguments=[...], output_path=...), ...], max_jobs=4, timeout=600)
+
+    # in asyncio code
+    runner = FfmpegRunner(max_jobs=4)
+    await asyncio.gather(runner.run([...]), runner.run([...]))
+
+ffmpeg is started without a shell, with a list of arguments. Its progress (-progress pipe:1) is reported as
+events like {'event': 'progress', 'frame': 120, 'fps': 60.0, 'eta': 3.5, ...}. When ffmpeg fails, FfmpegError is
+raised with the exit code and the last lines ffmpeg wrote to stderr. When a job is cancelled or takes longer than
+its timeout, ffmpeg is stopped, and the unfinished output file is removed.
+"""
+import asyncio
+import collections
+import os
+import shutil
+
+FFMPEG_EXECUTABLE = 'ffmpeg'
+DEFAULT_MAX_JOBS = os.cpu_count() or 1
+STDERR_LINES = 30  # the number of lines of stderr in the message of FfmpegError
+STOP_TIMEOUT = 5  # seconds to wait for ffmpeg to stop, before it is killed
+
+
+class FfmpegError(Exception):
+    def __init__(self, arguments: list, return_code: int, stderr: str):
+        self.arguments = arguments
+        self.return_code = return_code
+        self.stderr = stderr
+        super().__init__('ffmpeg exited with code {}: {}\n{}'.format(return_code, ' '.join(arguments), stderr))
+
+
+def _parse_progress(values: dict, total_frames: int = None):
+    """
+    Make an event of one block of -progress output (key=value lines, ending with progress=continue or
+    progress=end). The ETA (in seconds) is only known when the total number of frames is known.
+    """
+    def number(key, type_=float):
+        try:
+            return type_(values[key])
+        except (KeyError, ValueError):
+            return None  # 'N/A' at the start
+
+    frame = number('frame', int)
+    fps = number('fps')
+    out_time_us = number('out_time_us', int)
+    eta = None
+    if total_frames and frame is not None and fps:
+        eta = max(total_frames - frame, 0) / fps
+
+    return {
+        'event': 'progress',
+        'frame': frame,
+        'total_frames': total_frames,
+        'fps': fps,
+        'seconds': out_time_us / 1e6 if out_time_us is not None else None,
+        'speed': values.get('speed'),
+        'eta': eta,
+        'done': values.get('progress') == 'end',
+    }
+
+
+class FfmpegRunner:
+    def __init__(self, max_jobs: int = None, timeout: float = None, on_progress=None):
+        """
+        max_jobs: the maximum number of ffmpeg processes at the same time (by default the number of cpus)
+        timeout: the default timeout of a job in seconds, None to wait for as long as it takes
+        on_progress: the default function that is called with every progress event
+        """
+        self.max_jobs = max_jobs or DEFAULT_MAX_JOBS
+        self.timeout = timeout
+        self.on_progress = on_progress
+        self._semaphore = None  # made in the event loop, on the first run
+
+    async def run(
+        self,
+        arguments: list,
+        input_chunks=None,
+        total_frames: int = None,
+        output_path: str = None,
+        timeout: float = None,
+        on_progress=None,
+        buffer_size: int = 8,
+    ):
+        """
+        Run ffmpeg with the arguments (without the executable), after waiting for a free slot.
+
+        input_chunks: an iterable of bytes (or buffers) that is written to stdin of ffmpeg (use '-i -'). It is
+            iterated in a thread, so a slow generator does not block the event loop, and at most 'buffer_size'
+            chunks are waiting to be written.
+        total_frames: the number of frames of the output, for the ETA in the progress events
+        output_path: this file is removed when ffmpeg fails, or the job is cancelled (unless it already existed)
+
+        Return output_path. Raise FfmpegError when ffmpeg fails, and asyncio.TimeoutError after the timeout.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_jobs)
+        timeout = self.timeout if timeout is None else timeout
+        on_progress = on_progress or self.on_progress
+        output_existed = output_path is not None and os.path.exists(output_path)
+
+        async with self._semaphore:
+            try:
+                await asyncio.wait_for(
+                    self._run(arguments, input_chunks, total_frames, output_path, on_progress, buffer_size),
+                    timeout=timeout)
+            except BaseException:
+                # failed, cancelled or timed out: do not leave half a video behind
+                if output_path is not None and not output_existed and os.path.exists(output_path):
+                    os.unlink(output_path)
+                raise
+        return output_path
+
+    async def _run(self, arguments, input_chunks, total_frames, output_path, on_progress, buffer_size):
+        executable = shutil.which(FFMPEG_EXECUTABLE)
+        if executable is None:
+            raise FileNotFoundError('{} is not installed (or not on the PATH)'.format(FFMPEG_EXECUTABLE))
+
+        command = [executable, '-hide_banner', '-nostats', '-progress', 'pipe:1'] + [str(a) for a in arguments]
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE if input_chunks is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stderr_lines = collections.deque(maxlen=STDERR_LINES)
+        tasks = [
+            asyncio.ensure_future(self._read_progress(process.stdout, total_frames, output_path, on_progress)),
+            asyncio.ensure_future(self._read_stderr(process.stderr, stderr_lines)),
+        ]
+        if input_chunks is not None:
+            tasks.append(asyncio.ensure_future(self._write_input(process.stdin, input_chunks, buffer_size)))
+
+        try:
+            return_code = await process.wait()
+            if input_chunks is not None:
+                tasks[2].cancel()  # ffmpeg has stopped, it does not need more input
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        except BaseException:
+            if input_chunks is not None:
+                tasks[2].cancel()
+            await self._stop(process)
+            # read stdout and stderr to the end, so the subprocess transport is closed before the event loop is
+            await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+            for task in tasks:
+                task.cancel()
+            raise
+
+        if return_code != 0:
+            raise FfmpegError(command, return_code, ''.join(stderr_lines))
+        for result in results:
+            if isinstance(result, Exception) and not isinstance(result, (BrokenPipeError, ConnectionResetError)):
+                raise result  # for example a frame of the wrong size
+
+    @staticmethod
+    async def _stop(process):
+        if process.returncode is not None:
+            return
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), timeout=STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    async def _write_input(stdin, input_chunks, buffer_size: int):
+        """
+        A thread takes the chunks from the iterable, while the chunks before it are written. When ffmpeg can not
+        keep up, the thread waits (the queue is full), so the memory use is bounded.
+        """
+        loop = asyncio.get_event_loop()
+        chunk_queue = asyncio.Queue(maxsize=buffer_size)
+        end = object()
+
+        async def produce():
+            try:
+                chunks = iter(input_chunks)
+                while True:
+                    chunk = await loop.run_in_executor(None, next, chunks, end)
+                    if chunk is end:
+                        break
+                    await chunk_queue.put(chunk)
+            finally:
+                # also when the generator raised an exception, it is raised by 'await producer' below
+                await chunk_queue.put(end)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                chunk = await chunk_queue.get()
+                if chunk is end:
+                    break
+                stdin.write(chunk)
+                await stdin.drain()
+            await producer  # raise an exception of the generator
+        finally:
+            producer.cancel()
+            stdin.close()
+
+    @staticmethod
+    async def _read_progress(stdout, total_frames, output_path, on_progress):
+        values = {}
+        async for line in stdout:
+            key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+            values[key] = value
+            if key == 'progress':
+                if on_progress is not None:
+                    event = _parse_progress(values, total_frames)
+                    event['output_path'] = output_path
+                    on_progress(event)
+                values = {}
+
+    @staticmethod
+    async def _read_stderr(stderr, stderr_lines):
+        async for line in stderr:
+            stderr_lines.append(line.decode('utf-8', 'replace'))
+
+
+async def _run_jobs(jobs: list, max_jobs: int, timeout: float, on_progress):
+    runner = FfmpegRunner(max_jobs=max_jobs, timeout=timeout, on_progress=on_progress)
+    tasks = [asyncio.ensure_future(runner.run(**job)) for job in jobs]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        # when one job failed, the others are stopped
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_ffmpeg_jobs(jobs: list, max_jobs: int = None, timeout: float = None, on_progress=None):
+    """
+    Run the jobs (dictionaries with the arguments of FfmpegRunner.run) at the same time, at most 'max_jobs' at
+    once. Return the list of their output paths. When a job fails, the other jobs are stopped and the error is
+    raised.
+
+    This starts an event loop, so it can not be called from asyncio code, use FfmpegRunner there.
+    """
+    return asyncio.run(_run_jobs(jobs, max_jobs=max_jobs, timeout=timeout, on_progress=on_progress))
+
+
+def run_ffmpeg(arguments: list, **job):
+    """
+    Run one ffmpeg process, see FfmpegRunner.run for the keyword arguments.
+    """
+    return run_ffmpeg_jobs([dict(arguments=arguments, **job)])[0]
@@ -3,9 +3,13 @@ import shutil
 from hashlib import md5
 from time import time
 
-from helpers import split_file_path, get_sorted_file_paths, determine_new_file_path
+from bulk_rename import bulk_rename, rename_no_replace
+from duplicate_files import find_duplicate_files, replace_duplicates_with_hardlinks
+from helpers import split_file_path, scan_directory, UniquePathAllocator, copy_file
+from tracing import traced
 
 
+@traced
 def prefix_filename(file_path: str, prefix: str = '_'):
     if os.path.isdir(file_path):
         file_name = os.path.basename(file_path)
@@ -16,9 +20,10 @@ def prefix_filename(file_path: str, prefix: str = '_'):
         new_file_name = '{}{}.{}'.format(prefix, file_name, extension)
 
     new_file_path = os.path.join(directory, new_file_name)
-    os.rename(file_path, new_file_path)
+    rename_no_replace(file_path, new_file_path)
 
 
+@traced
 def postfix_filename(file_path: str, postfix: str = '_'):
     if os.path.isdir(file_path):
         file_name = os.path.basename(file_path)
@@ -29,25 +34,40 @@ def postfix_filename(file_path: str, postfix: str = '_'):
         new_file_name = '{}{}.{}'.format(file_name, postfix, extension)
 
     new_file_path = os.path.join(directory, new_file_name)
-    os.rename(file_path, new_file_path)
+    rename_no_replace(file_path, new_file_path)
 
 
-def split_large_folder(directory_path: str, files_per_sub_folder: int = 100):
+@traced
+def split_large_folder(
+    directory_path: str,
+    files_per_sub_folder: int = 100,
+    natural_sort: bool = False,
+    max_workers: int = 1,
+):
     """
     Split one directory into subdirectories of maximum 'files_per_sub_folder'.
     This can be useful when a directory becomes too large to download or upload at once, or to open in the filesystem.
+
+    When 'natural_sort' is checked, numbers in the file names are sorted by value (frame9 before frame10).
+    The files are moved with bulk_rename, use 'max_workers' > 1 to move them in parallel on a network file system.
     """
+    # read the full listing first, the new sub directories should not end up in the listing
+    entries = list(scan_directory(directory_path=directory_path, sort='natural' if natural_sort else 'name'))
+
+    renames = []
     destination_directory = None  # will be set in the first iterations, then every files_per_sub_folder times
-    for index, file_path in enumerate(get_sorted_file_paths(directory_path=directory_path)):
+    for index, entry in enumerate(entries):
         if index % files_per_sub_folder == 0:
             destination_directory = os.path.join(directory_path, str(index // files_per_sub_folder))
             os.mkdir(destination_directory)
 
-        destination = os.path.join(destination_directory, os.path.basename(file_path))
-        os.rename(file_path, destination)
+        renames.append((entry.path, os.path.join(destination_directory, entry.name)))
+
+    bulk_rename(renames, max_workers=max_workers)
 
 
-def weed_out_files(directory_path: list, keep_one_file_out_of: int = 2):
+@traced
+def weed_out_files(directory_path: list, keep_one_file_out_of: int = 2, natural_sort: bool = False):
     """
     Loop through all the files in the directory, ordered by filename, and permanently delete files.
     Only keep one file out of 'keep_one_file_out_of'.
@@ -56,12 +76,19 @@ def weed_out_files(directory_path: list, keep_one_file_out_of: int = 2):
 
     This is useful for animation frames that take too much disk space. You can keep some amount of the still
     images, but get rid of most of them.
+
+    When 'natural_sort' is checked, numbers in the file names are sorted by value (frame9 before frame10).
+
+    To keep the frames with the most motion instead of every n-th frame, see thin_frames_by_motion in
+    frame_operations.py.
     """
-    for index, file_path in enumerate(get_sorted_file_paths(directory_path=directory_path)):
+    entries = scan_directory(directory_path=directory_path, sort='natural' if natural_sort else 'name')
+    for index, entry in enumerate(entries):
         if index % keep_one_file_out_of > 0:
-            os.unlink(file_path)
+            os.unlink(entry.path)
 
 
+@traced
 def make_filename_unrecognizable(file_path: str, keep_original: bool = True):
     """
     Rename the filename with a MD5 hash, based on the file path in combination with a filepath.
@@ -87,19 +114,29 @@ def make_filename_unrecognizable(file_path: str, keep_original: bool = True):
     return new_file_path
 
 
+# the new name depends on the current time, a stored result can not be reused
+make_filename_unrecognizable.cacheable = lambda params: False
+
+
+@traced
 def number_filenames(
     file_paths: list,
     start_index: int = 0,
     step: int = 1,
     number_prefix: str = '',
-    pre_or_postfix: str = 'prefix'
+    pre_or_postfix: str = 'prefix',
+    max_workers: int = 1,
 ):
     """
     Prefix the file paths (in alphabetically order) with a number (equally spaced, so when the maximum is 100, the first
     ones are 000, 001). The start index and step can be specified, so it can be 0100, 0200, 0300, 0400, etc.
+
+    All new names are checked before the first file is renamed, nothing is renamed when a name is already taken.
+    The files are renamed with bulk_rename, use 'max_workers' > 1 to rename in parallel on a network file system.
     """
     length_largest_index = len(str(start_index + len(file_paths) * step))
 
+    renames = []
     index = start_index
     for file_path in sorted(file_paths):
         # prefix the index_string with zero's when needed
@@ -115,31 +152,59 @@ def number_filenames(
         else:
             new_file_name = '{}_{}.{}'.format(number_part, file_name, extension)
 
-        os.rename(file_path, os.path.join(directory, new_file_name))
+        renames.append((file_path, os.path.join(directory, new_file_name)))
 
         index += step
 
+    bulk_rename(renames, max_workers=max_workers)
+
 
 number_filenames.combo_choices = {'pre_or_postfix': ['prefix', 'postfix']}
 
 
-def sort_files_by_size(directory_path: str):
+@traced
+def sort_files_by_size(directory_path: str, compare_content: bool = True, use_hardlinks: bool = False):
     """
     Go through all files in a directory, and look at the file size in bytes.
     If there is more then one files with the same size in bytes, make a sub_folder and move the files to there.
     Leave all the files with a unique size in the main directory.
 
+    When 'compare_content' is checked, only files with exactly the same content are moved together (files with the
+    same size are not necessarily identical). When there are several sets of duplicates with the same size,
+    the sub_folders will be named size_0, size_1, etc.
+
+    When 'use_hardlinks' is checked (only in combination with 'compare_content'), the duplicates are not moved,
+    but every duplicate is replaced by a hardlink to the first file of its set. This frees the disk space of the
+    duplicates, but keeps all file names.
+
     If every file was generated in a different way, you could detect identical outcomes
     (make sure the file name contains the relevant parameters, so you can understand which ones give the same result).
     """
-    size_path_dict = dict()
-    for file_path in get_sorted_file_paths(directory_path=directory_path):
-        size_path_dict.setdefault(os.path.getsize(file_path), []).append(file_path)
+    # the order does not matter for grouping, so the files are handled while the directory is read
+    entries = scan_directory(directory_path=directory_path, sort=None, include_directories=False)
+
+    if compare_content:
+        duplicate_files = find_duplicate_files(entries)
+        if use_hardlinks:
+            replace_duplicates_with_hardlinks(duplicate_files)
+            return
+
+        size_path_dict = dict()
+        for paths in duplicate_files:
+            size_path_dict.setdefault(os.path.getsize(paths[0]), []).append(paths)
+    else:
+        size_path_dict = dict()
+        for entry in entries:
+            size_path_dict.setdefault(entry.stat().st_size, [[]])[0].append(entry.path)
+
+    for file_size, duplicate_sets in size_path_dict.items():
+        for index, paths in enumerate(duplicate_sets):
+            if len(paths) < 2:
+                continue
 
-    for file_size, paths in size_path_dict.items():
-        if len(paths) > 1:
             # make a new folder, and move all the paths in there
-            new_folder_path = os.path.join(directory_path, str(file_size))
+            folder_name = str(file_size) if len(duplicate_sets) == 1 else '{}_{}'.format(file_size, index)
+            new_folder_path = os.path.join(directory_path, folder_name)
             os.mkdir(new_folder_path)
 
             for file_path in paths:
@@ -149,12 +214,17 @@ def sort_files_by_size(directory_path: str):
                 os.rename(file_path, os.path.join(new_folder_path, new_file_name))
 
 
-def duplicate_file(file_path: str, number_of_duplicates: int = 10):
+@traced
+def duplicate_file(file_path: str, number_of_duplicates: int = 10, allow_hardlinks: bool = False):
     """
     Duplicate a file many times, every next one will be prefixed with (0), (1), (2), etc
+
+    The copies are made with copy_file: on file systems that support it, the copies share the data blocks with the
+    original (a reflink), so thousands of duplicates of a large file take almost no time and disk space.
+    When 'allow_hardlinks' is checked, hardlinks are used when the file system can not do reflinks or a kernel copy.
     """
+    # the directory is read once, instead of checking every possible name for every duplicate
+    path_allocator = UniquePathAllocator(os.path.dirname(file_path))
     for i in range(number_of_duplicates):
-        # this can be more efficient (just adding i to the filename),
-        # but the method below makes sure the new file name is unique
-        new_path = determine_new_file_path(file_path)
-        shutil.copy2(src=file_path, dst=new_path)
+        new_path = path_allocator.allocate(file_path)
+        copy_file(src=file_path, dst=new_path, allow_hardlink=allow_hardlinks)
@@ -0,0 +1,183 @@
+import math
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from PIL import Image, ImageDraw, ImageFilter
+
+from helpers import split_file_path, save_image, open_image
+from image_operations import Colors, make_random_filter
+
+PIL_KERNEL_SIZES = ((3, 3), (5, 5))  # ImageFilter.Kernel only supports these, larger kernels are done with numpy
+SEPARABLE_TOLERANCE = 1e-6
+# two 1D passes take one pass over the image per weight, above this number of weights (about 16x16) FFT is faster
+MAX_SEPARABLE_WEIGHTS = 32
+
+
+def _correlate_1d(pixels, weights, axis: int):
+    """
+    Slide the weights along one axis of the (padded) pixels: one multiply-add of the whole array per weight.
+    The result is len(weights) - 1 shorter along that axis.
+    """
+    pixels = numpy.moveaxis(pixels, axis, 0)
+    length = pixels.shape[0] - len(weights) + 1
+    result = numpy.zeros((length,) + pixels.shape[1:], dtype=numpy.float32)
+    buffer = numpy.empty_like(result)
+    for offset, weight in enumerate(weights):
+        numpy.multiply(pixels[offset:offset + length], numpy.float32(weight), out=buffer)
+        result += buffer
+    return numpy.moveaxis(result, 0, axis)
+
+
+def _correlate_fft(pixels, kernel):
+    """
+    Correlation of all channels with the kernel, as a multiplication in the frequency domain. Only the part of the
+    result where the kernel fits completely in the (padded) pixels is returned.
+    """
+    kernel_height, kernel_width = kernel.shape
+    height, width = pixels.shape[:2]
+
+    # correlation is convolution with the flipped kernel
+    kernel_spectrum = numpy.fft.rfft2(kernel[::-1, ::-1], s=(height, width))
+    spectrum = numpy.fft.rfft2(pixels, axes=(0, 1)) * kernel_spectrum[:, :, numpy.newaxis]
+    result = numpy.fft.irfft2(spectrum, s=(height, width), axes=(0, 1))
+    return result[kernel_height - 1:, kernel_width - 1:].astype(numpy.float32)
+
+
+def convolve_image(image, kernel, scale: float = None, offset: float = 0):
+    """
+    Apply a kernel of any size to the image, like ImageFilter.Kernel does (which only supports 3x3 and 5x5).
+    Every pixel becomes the sum of its neighbours multiplied by the kernel, divided by 'scale' (by default the sum
+    of the kernel, or 1 when that is 0), plus 'offset'. The image is extended at the edges with its edge pixels.
+
+    A kernel that is the product of a column and a row (like a gaussian blur) is separable: two 1D passes of
+    k operations per pixel, instead of k * k. Large kernels, and kernels that are not separable, are done with FFT,
+    where the size of the kernel does not matter.
+    """
+    kernel = numpy.asarray(kernel, dtype=numpy.float64)
+    if scale is None:
+        scale = kernel.sum() or 1
+    # ImageFilter.Kernel applies the first row of the kernel to the row below the pixel, do the same
+    kernel = kernel[::-1] / scale
+
+    pixels = numpy.asarray(image, dtype=numpy.float32)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, numpy.newaxis]
+
+    kernel_height, kernel_width = kernel.shape
+    padded = numpy.pad(pixels, (
+        (kernel_height // 2, (kernel_height - 1) // 2), (kernel_width // 2, (kernel_width - 1) // 2), (0, 0)
+    ), mode='edge')
+
+    u, singular_values, vt = numpy.linalg.svd(kernel)
+    is_separable = len(singular_values) == 1 or singular_values[1] <= SEPARABLE_TOLERANCE * singular_values[0]
+    if is_separable and kernel_height + kernel_width <= MAX_SEPARABLE_WEIGHTS:
+        column = u[:, 0] * math.sqrt(singular_values[0])
+        row = vt[0] * math.sqrt(singular_values[0])
+        result = _correlate_1d(_correlate_1d(padded, column, axis=0), row, axis=1)
+    else:
+        result = _correlate_fft(padded, kernel)
+
+    result = numpy.clip(numpy.rint(result + offset), 0, 255).astype(numpy.uint8)
+    if result.shape[2] == 1:
+        result = result[:, :, 0]
+    return Image.fromarray(result, mode=image.mode)
+
+
+def _kernel_filter(kernel):
+    """
+    Return a function that applies the kernel to an image, with ImageFilter.Kernel when Pillow supports the size.
+    """
+    kernel = numpy.asarray(kernel, dtype=numpy.float64)
+    if kernel.shape in PIL_KERNEL_SIZES:
+        pil_kernel = ImageFilter.Kernel(
+            size=kernel.shape, kernel=kernel.flatten().tolist(), scale=kernel.sum() or 1)
+        return lambda image: image.filter(pil_kernel)
+
+    return lambda image: convolve_image(image, kernel)
+
+
+def _make_comparison_sheet(original_image, labeled_images: list, columns: int):
+    """
+    All images on a grid, starting with the original, with their label above them (like save_both_images of
+    apply_filter, for any number of filters).
+    """
+    margin = 30
+    images = [('original', original_image)] + labeled_images
+    columns = min(columns, len(images))
+    rows = math.ceil(len(images) / columns)
+    width, height = original_image.size
+
+    sheet = Image.new(
+        mode=original_image.mode,
+        size=(columns * (width + margin) + margin, rows * (height + margin) + margin), color=Colors.white)
+    draw = ImageDraw.Draw(sheet)
+    for index, (label, image) in enumerate(images):
+        x = margin + (index % columns) * (width + margin)
+        y = margin + (index // columns) * (height + margin)
+        sheet.paste(im=image, box=(x, y))
+        draw.text((x, y - margin + 8), label, fill=Colors.black)
+
+    return sheet
+
+
+def apply_filters(
+    file_path: str,
+    filter_names: list = ('BLUR', 'CONTOUR', 'EMBOSS', 'FIND_EDGES', 'SHARPEN'),
+    number_of_random_filters: int = 0,
+    kernels: list = None,
+    comparison_sheet: bool = False,
+    columns: int = 4,
+    max_workers: int = None,
+):
+    """
+    Like apply_filter, for many filters at once: the image is decoded once, and all filters are applied in a thread
+    pool (Pillow releases the GIL while filtering).
+
+    filter_names: names of filters in ImageFilter (see apply_filter)
+    number_of_random_filters: the number of random 3x3 filters, their seeds are in the file names (or labels), so
+        a filter can be made again with apply_filter(file_path, filter_name='random', random_seed=seed)
+    kernels: a list of 2D kernels (lists of rows, or numpy arrays) of any size, see convolve_image
+
+    Every result is saved as a new file, post fixed with the filter (like apply_filter). With 'comparison_sheet',
+    one file is saved instead, with the original and all filtered images on a grid of 'columns' wide.
+    Return a list of the new file paths.
+    """
+    directory, file_name, extension = split_file_path(file_path)
+    original_image = open_image(file_path)
+    original_image.load()
+
+    filters = [(filter_name, lambda image, name=filter_name: image.filter(getattr(ImageFilter, name)))
+               for filter_name in filter_names]
+
+    # the seeds come from a generator of their own (seeded by the os), so they do not depend on each other
+    seed_generator = random.Random()
+    for _ in range(number_of_random_filters):
+        random_seed = str(seed_generator.randrange(10 ** 8))
+        random_filter = make_random_filter(random_seed)
+        filters.append(('random_seed{}'.format(random_seed), lambda image, f=random_filter: image.filter(f)))
+
+    for index, kernel in enumerate(kernels or []):
+        kernel_shape = numpy.shape(kernel)
+        filters.append(('kernel{}_{}x{}'.format(index, kernel_shape[1], kernel_shape[0]), _kernel_filter(kernel)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        filtered_images = list(executor.map(lambda item: item[1](original_image), filters))
+    labeled_images = [(label, image) for (label, _), image in zip(filters, filtered_images)]
+
+    if comparison_sheet:
+        sheet = _make_comparison_sheet(original_image, labeled_images, columns=columns)
+        new_file_path = os.path.join(directory, '{}_filters.{}'.format(file_name, extension))
+        return [save_image(pil_image=sheet, new_file_path=new_file_path, image_format=original_image.format)]
+
+    def save_filtered_image(item):
+        label, image = item
+        new_file_path = os.path.join(directory, '{}_{}.{}'.format(file_name, label, extension))
+        return save_image(pil_image=image, new_file_path=new_file_path, image_format=original_image.format)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(save_filtered_image, labeled_images))
+
+
+apply_filters.cacheable = lambda params: params['number_of_random_filters'] == 0
@@ -0,0 +1,225 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from PIL import Image, ImageOps
+
+from helpers import get_new_file_path, save_image, scan_directory, IMAGE_EXTENSIONS
+from image_operations import Colors
+
+THINNING_REPORT_FILE_NAME = 'frame_thinning_report.txt'
+
+
+def _load_frames(executor, file_paths: list, mode: str):
+    """
+    Decode the frames in threads (Pillow releases the GIL while decoding), directly into one contiguous array
+    with shape (len(file_paths), height, width[, channels]). All frames need to have the same size.
+    """
+    first_frame = numpy.asarray(Image.open(file_paths[0]).convert(mode))
+    frames = numpy.empty((len(file_paths),) + first_frame.shape, dtype=numpy.uint8)
+    frames[0] = first_frame
+
+    def load_frame(index):
+        frame = numpy.asarray(Image.open(file_paths[index]).convert(mode))
+        if frame.shape != first_frame.shape:
+            raise ValueError('All frames need to have the same size, {} does not'.format(file_paths[index]))
+        frames[index] = frame
+
+    list(executor.map(load_frame, range(1, len(file_paths))))
+    return frames
+
+
+def _save_frames(executor, frames, file_paths: list, post_fix_filename: str):
+    def save_frame(item):
+        frame, file_path = item
+        new_file_path = get_new_file_path(file_path, post_fix_filename=post_fix_filename)
+        return save_image(pil_image=Image.fromarray(frame), new_file_path=new_file_path)
+
+    return list(executor.map(save_frame, zip(frames, file_paths)))
+
+
+def _process_in_batches(file_paths: list, mode: str, batch_size: int, max_workers: int, function, post_fix_filename):
+    """
+    Load the frames in batches of 'batch_size', apply 'function' to the whole batch (an array with the frames on
+    the first axis) and save every resulting frame next to its original. Return the new file paths.
+    """
+    new_file_paths = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(file_paths), batch_size):
+            batch_file_paths = file_paths[start:start + batch_size]
+            frames = function(_load_frames(executor, batch_file_paths, mode=mode))
+            new_file_paths.extend(_save_frames(executor, frames, batch_file_paths, post_fix_filename))
+
+    return new_file_paths
+
+
+def frame_differences(file_paths: list, batch_size: int = 64, max_workers: int = None):
+    """
+    Like image_difference, for a sequence of frames: calculate the difference between every pair of consecutive
+    frames, and save it next to the first frame of the pair (with the same 'diff' post fix as image_difference).
+
+    The last frame of every batch is kept for the first pair of the next batch, so every frame is decoded once.
+    """
+    file_paths = sorted(file_paths)
+    new_file_paths = []
+    previous_frame = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(file_paths), batch_size):
+            frames = _load_frames(executor, file_paths[start:start + batch_size], mode='RGB')
+            if previous_frame is not None:
+                if previous_frame.shape != frames.shape[1:]:
+                    raise ValueError('All frames need to have the same size, {} does not'.format(file_paths[start]))
+                frames = numpy.concatenate([previous_frame[numpy.newaxis], frames])
+                start -= 1
+
+            # max - min is the absolute difference, without converting the uint8 pixels to a larger type
+            differences = numpy.maximum(frames[1:], frames[:-1]) - numpy.minimum(frames[1:], frames[:-1])
+            new_file_paths.extend(_save_frames(
+                executor, differences, file_paths[start:start + len(differences)], post_fix_filename='diff'))
+            previous_frame = frames[-1]
+
+    return new_file_paths
+
+
+def grayscale_frames(file_paths: list, batch_size: int = 64, max_workers: int = None):
+    """
+    Like grayscale (mode 'L') for many frames. Uses the same integer formula as Pillow, so the result is identical.
+    """
+    def to_grayscale(frames):
+        frames = frames.astype(numpy.uint32)
+        luminance = (frames[..., 0] * 19595 + frames[..., 1] * 38470 + frames[..., 2] * 7471 + 0x8000) >> 16
+        return luminance.astype(numpy.uint8)
+
+    return _process_in_batches(
+        sorted(file_paths), mode='RGB', batch_size=batch_size, max_workers=max_workers, function=to_grayscale,
+        post_fix_filename='grayscale_modeL')
+
+
+def solarize_frames(file_paths: list, threshold: int = 128, batch_size: int = 64, max_workers: int = None):
+    """
+    Like solarize for many frames: invert all pixel values above a threshold, with one lookup table for the batch.
+    """
+    lookup_table = numpy.arange(256, dtype=numpy.uint8)
+    lookup_table[threshold:] = 255 - lookup_table[threshold:]
+
+    return _process_in_batches(
+        sorted(file_paths), mode='RGB', batch_size=batch_size, max_workers=max_workers,
+        function=lambda frames: lookup_table[frames], post_fix_filename='solarized{}'.format(threshold))
+
+
+def color_grayscale_frames(
+    file_paths: list,
+    color_1: tuple = Colors.black,
+    mid_color: tuple = Colors.gray,
+    color_2: tuple = Colors.white,
+    use_mid_color: bool = False,
+
+    black_point: int = 0,
+    white_point: int = 255,
+    mid_point: int = 127,
+
+    batch_size: int = 64,
+    max_workers: int = None,
+):
+    """
+    Like color_grayscale for many frames. ImageOps.colorize is applied once to a ramp of all 256 gray values, which
+    gives a lookup table (256 x 3) from gray values to colors, that is applied to the whole batch.
+    """
+    ramp = Image.frombytes('L', (256, 1), bytes(range(256)))
+    colored_ramp = ImageOps.colorize(
+        image=ramp,
+        black=color_1,
+        white=color_2,
+        mid=mid_color if use_mid_color else None,
+        blackpoint=black_point, whitepoint=white_point, midpoint=mid_point)
+    lookup_table = numpy.asarray(colored_ramp)[0]
+
+    return _process_in_batches(
+        sorted(file_paths), mode='L', batch_size=batch_size, max_workers=max_workers,
+        function=lambda frames: lookup_table[frames], post_fix_filename='colorized')
+
+
+color_grayscale_frames.color_parameters = ('color_1', 'mid_color', 'color_2')
+
+
+def _load_small_frame(file_path: str, size: int):
+    """
+    A small grayscale version of the frame, draft mode lets the jpeg decoder skip most of the pixels.
+    """
+    image = Image.open(file_path)
+    image.draft('L', (size, size))
+    return numpy.asarray(image.convert('L').resize((size, size), Image.BILINEAR), dtype=numpy.float32)
+
+
+def calculate_change_scores(file_paths: list, size: int = 64):
+    """
+    Return a list with a score for every frame: the mean absolute difference (0 - 255) with the previous frame,
+    calculated on small grayscale versions of the frames. Only two frames are in memory at the same time.
+    The first frame has no previous frame, it gets the highest possible score.
+    """
+    scores = []
+    previous_frame = None
+    for file_path in file_paths:
+        frame = _load_small_frame(file_path, size=size)
+        scores.append(255.0 if previous_frame is None else float(numpy.abs(frame - previous_frame).mean()))
+        previous_frame = frame
+
+    return scores
+
+
+def thin_frames_by_motion(
+    directory_path: str,
+    keep_fraction: float = 0.5,
+    natural_sort: bool = False,
+    dry_run: bool = False,
+    size: int = 64,
+):
+    """
+    An alternative to weed_out_files for animation frames: instead of keeping every n-th file, keep the frames with
+    the most visual change, and delete the frames that (almost) repeat the frame before them.
+
+    The frames are kept in order of their change score (see calculate_change_scores), as long as their total file size
+    stays within 'keep_fraction' of the current total. The first and the last frame are always kept.
+
+    With 'dry_run', nothing is deleted. In both cases, a report with the score, the size and the decision for every
+    frame is written to 'frame_thinning_report.txt' in the directory.
+
+    Return the list of deleted file paths (the ones that would be deleted with 'dry_run').
+    """
+    entries = list(scan_directory(
+        directory_path=directory_path, allowed_extensions=IMAGE_EXTENSIONS,
+        sort='natural' if natural_sort else 'name', include_directories=False,
+    ))
+    if not entries:
+        return []
+
+    file_paths = [entry.path for entry in entries]
+    file_sizes = [entry.stat().st_size for entry in entries]
+    scores = calculate_change_scores(file_paths, size=size)
+
+    budget = keep_fraction * sum(file_sizes)
+    keep = {0, len(entries) - 1}
+    used = sum(file_sizes[index] for index in keep)
+    for index in sorted(range(1, len(entries) - 1), key=lambda index: scores[index], reverse=True):
+        # frames that do not fit are skipped, a smaller frame with a lower score might still fit
+        if used + file_sizes[index] <= budget:
+            keep.add(index)
+            used += file_sizes[index]
+
+    deleted_file_paths = [file_path for index, file_path in enumerate(file_paths) if index not in keep]
+
+    with open(os.path.join(directory_path, THINNING_REPORT_FILE_NAME), 'w') as report_file:
+        report_file.write('{} {} of {} frames, keeping {} of {} bytes ({:.0%})\n\n'.format(
+            'Would delete' if dry_run else 'Deleted', len(deleted_file_paths), len(entries),
+            used, sum(file_sizes), used / max(1, sum(file_sizes)),
+        ))
+        for index, entry in enumerate(entries):
+            report_file.write('{}\t{:7.2f}\t{:10}\t{}\n'.format(
+                'keep' if index in keep else 'delete', scores[index], file_sizes[index], entry.name))
+
+    if not dry_run:
+        for file_path in deleted_file_paths:
+            os.unlink(file_path)
+
+    return deleted_file_paths
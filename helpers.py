@@ -1,16 +1,111 @@
-import glob
+import importlib.util
+import io
 import os
-import piexif
+import re
+import shutil
+import struct
+import subprocess
+import sys
 
-from PIL import Image, TiffImagePlugin
+import tracing
 
 
+def lazy_import(module_name: str):
+    """
+    Return the module, but only execute it when one of its attributes is used for the first time.
+    The file operations use helpers as well, and should not pay for importing Pillow and piexif (every Nautilus
+    action starts a new process).
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    spec = importlib.util.find_spec(module_name)
+    if spec is None:
+        raise ModuleNotFoundError('No module named {!r}'.format(module_name), name=module_name)
+
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+piexif = lazy_import('piexif')
+Image = lazy_import('PIL.Image')
+JpegImagePlugin = lazy_import('PIL.JpegImagePlugin')
+TiffImagePlugin = lazy_import('PIL.TiffImagePlugin')
+
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # not available on Windows, reflinks are never used there
+
 TIFF_FORMAT = 'TIFF'
 JPEG_FORMAT = 'JPEG'
 
+FICLONE = 0x40049409  # ioctl request to share all data blocks of a file (reflink), from linux/fs.h
+COPY_BUFFER_SIZE = 1024 * 1024
+IMAGE_EXTENSIONS = ['jpeg', 'jpg', 'png', 'tif', 'tiff', 'bmp', 'gif', 'webp']
+
+
+def natural_sort_key(name: str):
+    """
+    Sort numbers in names by their value, so 'frame9' comes before 'frame10'.
+    """
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+SORT_KEYS = {
+    'name': lambda entry: entry.name,
+    'natural': lambda entry: natural_sort_key(entry.name),
+}
+
+
+def scan_directory(
+    directory_path: str,
+    allowed_extensions: list = None,
+    recursive: bool = False,
+    sort: str = 'name',
+    include_directories: bool = True,
+    include_hidden: bool = False,
+):
+    """
+    Yield the entries (os.DirEntry) in a directory. An os.DirEntry knows if it is a file or a directory without an
+    extra system call, and caches its stat result, so calling entry.stat().st_size does not stat the file again.
+
+    sort: 'name' (alphabetical), 'natural' (numbers by value, see natural_sort_key) or None.
+    With None, entries are yielded in the order of the file system, while the directory is read. Use this for
+    huge directories when the order does not matter, the first entries are available immediately.
+
+    allowed_extensions: when given, only yield files with one of these (lower case) extensions.
+    recursive: also yield the entries of all sub directories (depth first).
+    Hidden files (starting with a dot) are skipped, like glob does, unless 'include_hidden' is set.
+    """
+    with os.scandir(directory_path) as scandir_iterator:
+        if sort is None:
+            entries = scandir_iterator
+        else:
+            entries = sorted(scandir_iterator, key=SORT_KEYS[sort])
+
+        for entry in entries:
+            if not include_hidden and entry.name.startswith('.'):
+                continue
+
+            if entry.is_dir():
+                if include_directories:
+                    yield entry
+                if recursive:
+                    yield from scan_directory(
+                        entry.path, allowed_extensions=allowed_extensions, recursive=recursive, sort=sort,
+                        include_directories=include_directories, include_hidden=include_hidden,
+                    )
+            elif allowed_extensions is None or entry.name.split('.')[-1].lower() in allowed_extensions:
+                yield entry
+
 
 def get_sorted_file_paths(directory_path):
-    return sorted(glob.glob(os.path.join(directory_path, '*')))
+    return [entry.path for entry in scan_directory(directory_path=directory_path)]
 
 
 def split_file_path(file_path):
@@ -40,6 +135,30 @@ def sort_and_filter_extensions(file_paths, allowed_extensions=None):
     return sorted(file_paths)
 
 
+def reduce_image_for_size(pil_image, size: tuple, reducing_gap: float = 2.0):
+    """
+    Take a freshly opened image that will be scaled down to 'size', and reduce it in a cheap way first.
+
+    For jpeg images, use draft mode: libjpeg decodes the image directly at 1/2, 1/4 or 1/8 of the resolution
+    (scaling the DCT), which is a lot faster and needs a lot less memory than decoding all pixels.
+    For other formats, the image is reduced by an integer factor (a fast box filter).
+
+    The image is never reduced below 'reducing_gap' times the size, so the final resample (like LANCZOS)
+    still has enough pixels to give a result that is hard to distinguish from resampling the full image.
+    """
+    minimum_size = (int(size[0] * reducing_gap), int(size[1] * reducing_gap))
+
+    if pil_image.format == JPEG_FORMAT:
+        pil_image.draft(pil_image.mode, minimum_size)
+        return pil_image
+
+    factor = min(pil_image.width // max(minimum_size[0], 1), pil_image.height // max(minimum_size[1], 1))
+    if factor > 1:
+        return pil_image.reduce(factor)
+
+    return pil_image
+
+
 def put_originals_in_subdirectory(file_paths):
     """
     For some file operations, instead of permanently deleting the originals,
@@ -73,15 +192,98 @@ def determine_new_file_path(new_file_path):
     return new_path
 
 
-def save_image(pil_image, new_file_path, enforce_unique_path=True, image_format=None):
+class UniquePathAllocator:
     """
-    If the new_file_path already exists, determine a unique name, like new_file_path(2).jpeg
+    Hand out unique file paths like determine_new_file_path does: new_file_path(0).jpeg, new_file_path(1).jpeg, etc.
 
-    In case it is a jpeg file, keep the quality and subsampling.
+    determine_new_file_path checks the file system for every candidate, so asking for n unique names takes n * n / 2
+    checks. This reads the directory once, keeps the taken names in a set, and remembers the next free index for
+    every name. Only use it while no other process adds files with the same names to the directory.
     """
-    if enforce_unique_path and os.path.exists(new_file_path):
-        new_file_path = determine_new_file_path(new_file_path)
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.taken_names = set(os.listdir(directory or '.'))
+        self.next_indexes = {}
+
+    def allocate(self, new_file_path: str):
+        directory, file_name, extension = split_file_path(new_file_path)
+
+        index = self.next_indexes.get((file_name, extension), 0)
+        new_file_name = '{}({}).{}'.format(file_name, index, extension)
+        while new_file_name in self.taken_names:
+            index += 1
+            new_file_name = '{}({}).{}'.format(file_name, index, extension)
 
+        self.taken_names.add(new_file_name)
+        self.next_indexes[(file_name, extension)] = index + 1
+        return os.path.join(directory, new_file_name)
+
+
+def _reflink(source, destination):
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this system')
+    fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+
+
+def _copy_file_range(source, destination):
+    if not hasattr(os, 'copy_file_range'):  # Linux only, Python 3.8+
+        raise OSError('copy_file_range is not supported on this system')
+
+    remaining = os.fstat(source.fileno()).st_size
+    while remaining > 0:
+        copied = os.copy_file_range(source.fileno(), destination.fileno(), remaining)
+        if copied == 0:
+            # the file is shorter than its size said, or the file system copied nothing: let copy_file start over
+            # with the next method, instead of leaving a truncated copy
+            raise OSError('copy_file_range stopped with {} bytes left'.format(remaining))
+        remaining -= copied
+
+
+def copy_file(src: str, dst: str, allow_hardlink: bool = False):
+    """
+    Copy a file (including the permission bits and timestamps, like shutil.copy2), in the cheapest way possible.
+    The destination should not exist. Try, in this order:
+    1. a reflink: the copy shares the data blocks with the original until one of them changes (btrfs, xfs).
+       This costs almost nothing, no matter how large the file is.
+    2. os.copy_file_range: the kernel copies the data, without passing it through Python (and on NFS or some
+       file systems, the server or the file system does the copy).
+    3. only when 'allow_hardlink' is set: a hardlink. Note that the 'copy' is then the same file: changing one
+       changes the other.
+    4. a buffered copy.
+
+    Return the method that was used: 'reflink', 'copy_file_range', 'hardlink' or 'buffered'.
+    """
+    with open(src, 'rb') as source, open(dst, 'xb') as destination:
+        for method, copy_function in (('reflink', _reflink), ('copy_file_range', _copy_file_range)):
+            try:
+                copy_function(source, destination)
+                break
+            except OSError:
+                # start over with the next method
+                destination.seek(0)
+                destination.truncate()
+                source.seek(0)
+        else:
+            method = None
+
+    if method is None and allow_hardlink:
+        try:
+            os.unlink(dst)
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            open(dst, 'xb').close()
+
+    if method is None:
+        method = 'buffered'
+        with open(src, 'rb') as source, open(dst, 'wb') as destination:
+            shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
+
+    shutil.copystat(src, dst)
+    return method
+
+
+def _get_save_params(pil_image):
     extra_params = {}
     if pil_image.format == 'JPEG':
         # if you are not satisfied with the quality of adjusted jpeg images, the commented code below might achieve
@@ -97,14 +299,246 @@ def save_image(pil_image, new_file_path, enforce_unique_path=True, image_format=
         extra_params['subsampling'] = 0
         extra_params['quality'] = 'keep'
 
-    pil_image.save(
-        fp=new_file_path,
-        format=pil_image.format if image_format is None else image_format,
-        **extra_params,
-    )
+    return extra_params
+
+
+def open_image(file_path):
+    """
+    Image.open only reads the header, the pixels are decoded the first time they are used (image.load()).
+    With tracing enabled, opening and decoding are separate spans, no matter where the decode happens.
+    """
+    if not tracing.is_enabled():
+        return Image.open(file_path)
+
+    with tracing.span('open', file_bytes=os.path.getsize(file_path)):
+        image = Image.open(file_path)
+
+    load = image.load
+
+    def traced_load():
+        if not image.tile:  # already decoded
+            return load()
+        with tracing.span('decode', format=image.format) as decode_span:
+            pixel_access = load()
+            decode_span.set(pixels=image.width * image.height)
+        return pixel_access
+
+    image.load = traced_load
+    return image
+
+
+@tracing.traced
+def save_image(pil_image, new_file_path, enforce_unique_path=True, image_format=None):
+    """
+    If the new_file_path already exists, determine a unique name, like new_file_path(2).jpeg
+
+    In case it is a jpeg file, keep the quality and subsampling.
+    """
+    if enforce_unique_path and os.path.exists(new_file_path):
+        new_file_path = determine_new_file_path(new_file_path)
+
+    image_format = pil_image.format if image_format is None else image_format
+    if not tracing.is_enabled():
+        pil_image.save(fp=new_file_path, format=image_format, **_get_save_params(pil_image))
+        return new_file_path
+
+    # encode in memory first, so encoding and writing to the file system are separate spans
+    if image_format is None:
+        image_format = Image.registered_extensions()[os.path.splitext(new_file_path)[1].lower()]
+    data = encode_image(pil_image, image_format=image_format)
+    with tracing.span('write', bytes=len(data)):
+        with open(new_file_path, 'wb') as new_file:
+            new_file.write(data)
+    return new_file_path
+
+
+def encode_image(pil_image, image_format: str):
+    """
+    Encode the image in memory, with the same parameters as save_image, and return the bytes.
+    Pillow releases the GIL while encoding, so this can be used to encode several images in threads at the same time.
+    """
+    with tracing.span('encode', format=image_format) as encode_span:
+        buffer = io.BytesIO()
+        pil_image.save(fp=buffer, format=image_format, **_get_save_params(pil_image))
+        encode_span.set(pixels=pil_image.width * pil_image.height, bytes=buffer.tell())
+    return buffer.getvalue()
+
+
+def get_jpeg_mcu_size(pil_image):
+    """
+    Return the (width, height) of a jpeg MCU (minimum coded unit, the blocks that are encoded together), which
+    depends on the chroma subsampling. Return None when it can not be determined.
+    """
+    if pil_image.mode == 'L':
+        return 8, 8
+
+    # see JpegImagePlugin.get_sampling: 0 is 4:4:4, 1 is 4:2:2 and 2 is 4:2:0
+    return {0: (8, 8), 1: (16, 8), 2: (16, 16)}.get(JpegImagePlugin.get_sampling(pil_image))
+
+
+def is_mcu_aligned(pil_image, box: tuple):
+    """
+    A jpeg can only be cropped losslessly when the left and top of the box are on an MCU boundary.
+    The right and bottom do not matter.
+    """
+    mcu_size = get_jpeg_mcu_size(pil_image)
+    return mcu_size is not None and box[0] % mcu_size[0] == 0 and box[1] % mcu_size[1] == 0
+
+
+def jpeg_transform_backend():
+    """
+    'jpegtran' when lossless_jpeg_transform can be used, 'pillow' when the operations fall back to decoding and
+    encoding. The results differ, so the result cache keeps them apart.
+    """
+    return 'jpegtran' if shutil.which('jpegtran') is not None else 'pillow'
+
+
+def lossless_jpeg_transform(file_path: str, new_file_path: str, arguments: list):
+    """
+    Rotate, flip or crop a jpeg with jpegtran (libjpeg), without decoding to pixels: the DCT coefficients are
+    rearranged, so there is no loss in quality, and it is a lot faster than decoding and encoding again.
+    Arguments are jpegtran options, like ['-rotate', '90'].
+
+    Only the comments are copied, not the exif data: its Orientation tag and thumbnail describe the untransformed
+    image, so a camera jpeg would be shown rotated twice. This is the same as the Pillow operations, which save
+    the image without exif data (see save_image).
+
+    Rotations and flips use '-perfect', so jpegtran fails instead of leaving the partial blocks at the edge
+    untransformed. For crops, check is_mcu_aligned first.
+
+    Return the new file path (unique, like save_image), or None when jpegtran is not installed or fails. Then the
+    caller can fall back to the Pillow operation.
+    """
+    if shutil.which('jpegtran') is None:
+        return
+
+    if os.path.exists(new_file_path):
+        new_file_path = determine_new_file_path(new_file_path)
+
+    if '-crop' not in arguments:
+        arguments = ['-perfect'] + arguments
+
+    command = ['jpegtran', '-copy', 'comments'] + arguments + ['-outfile', new_file_path, file_path]
+    if subprocess.run(command, stderr=subprocess.DEVNULL).returncode != 0:
+        if os.path.exists(new_file_path):
+            os.unlink(new_file_path)
+        return
+
     return new_file_path
 
 
+class StripTiffWriter:
+    """
+    Write an uncompressed RGB (or L) TIFF file strip by strip, so an image that does not fit in memory can be
+    written while it is rendered. Only one strip has to be in memory at a time.
+
+    Usage:
+        with StripTiffWriter(file_path, width, height, rows_per_strip) as writer:
+            for strip in strips:  # PIL images of (width, rows_per_strip), the last one can have less rows
+                writer.write_strip(strip)
+
+    The pixel data is written directly after the header, the IFD (the tags, with the strip offsets) at the end.
+    When the file will be larger than 4 GB, it is written as a BigTIFF (64 bit offsets).
+    When an exception leaves the with block, the unfinished file is removed.
+    """
+    SHORT, LONG, LONG8 = 3, 4, 16
+    TYPE_FORMATS = {SHORT: 'H', LONG: 'I', LONG8: 'Q'}
+
+    def __init__(self, file_path: str, width: int, height: int, rows_per_strip: int, mode: str = 'RGB'):
+        self.file_path = file_path
+        self.width = width
+        self.height = height
+        self.rows_per_strip = rows_per_strip
+        self.mode = mode
+        self.samples_per_pixel = len(mode)
+
+        self.big_tiff = width * height * self.samples_per_pixel > 2 ** 32 - 2 ** 24  # leave room for the IFD
+        self.offset_type = self.LONG8 if self.big_tiff else self.LONG
+        self.strip_offsets = []
+        self.strip_byte_counts = []
+        self.rows_written = 0
+
+        self.file = open(file_path, 'wb')
+        if self.big_tiff:
+            self.file.write(struct.pack('<2sHHHQ', b'II', 43, 8, 0, 0))
+        else:
+            self.file.write(struct.pack('<2sHI', b'II', 42, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # the header would claim strips that were never written, do not leave a broken file behind
+            self.file.close()
+            os.unlink(self.file_path)
+
+    def write_strip(self, pil_image):
+        if pil_image.mode != self.mode or pil_image.width != self.width:
+            raise ValueError('A strip should be a {} image with a width of {}'.format(self.mode, self.width))
+
+        strip_bytes = pil_image.tobytes()
+        self.strip_offsets.append(self.file.tell())
+        self.strip_byte_counts.append(len(strip_bytes))
+        self.file.write(strip_bytes)
+        self.rows_written += pil_image.height
+
+    def _pack_values(self, value_type: int, values: list):
+        return struct.pack('<{}{}'.format(len(values), self.TYPE_FORMATS[value_type]), *values)
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError('{} rows were written, the image height is {}'.format(self.rows_written, self.height))
+
+        tags = [
+            (256, self.LONG, [self.width]),  # ImageWidth
+            (257, self.LONG, [self.height]),  # ImageLength
+            (258, self.SHORT, [8] * self.samples_per_pixel),  # BitsPerSample
+            (259, self.SHORT, [1]),  # Compression: none
+            (262, self.SHORT, [2 if self.samples_per_pixel == 3 else 1]),  # PhotometricInterpretation: RGB or L
+            (273, self.offset_type, self.strip_offsets),  # StripOffsets
+            (277, self.SHORT, [self.samples_per_pixel]),  # SamplesPerPixel
+            (278, self.LONG, [self.rows_per_strip]),  # RowsPerStrip
+            (279, self.offset_type, self.strip_byte_counts),  # StripByteCounts
+            (284, self.SHORT, [1]),  # PlanarConfiguration: chunky
+        ]
+
+        # values that do not fit in an IFD entry are written before the IFD, the entry points to them
+        inline_size = 8 if self.big_tiff else 4
+        entries = []
+        for tag, value_type, values in tags:
+            data = self._pack_values(value_type, values)
+            if len(data) > inline_size:
+                if self.file.tell() % 2:
+                    self.file.write(b'\0')  # offsets should be on a word boundary
+                offset = self.file.tell()
+                self.file.write(data)
+                data = self._pack_values(self.offset_type, [offset])
+            entries.append((tag, value_type, len(values), data.ljust(inline_size, b'\0')))
+
+        if self.file.tell() % 2:
+            self.file.write(b'\0')
+        ifd_offset = self.file.tell()
+        if self.big_tiff:
+            self.file.write(struct.pack('<Q', len(entries)))
+            for tag, value_type, count, data in entries:
+                self.file.write(struct.pack('<HHQ', tag, value_type, count) + data)
+            self.file.write(struct.pack('<Q', 0))  # no next IFD
+            self.file.seek(8)
+            self.file.write(struct.pack('<Q', ifd_offset))
+        else:
+            self.file.write(struct.pack('<H', len(entries)))
+            for tag, value_type, count, data in entries:
+                self.file.write(struct.pack('<HHI', tag, value_type, count) + data)
+            self.file.write(struct.pack('<I', 0))  # no next IFD
+            self.file.seek(4)
+            self.file.write(struct.pack('<I', ifd_offset))
+
+        self.file.close()
+
+
 TAG_ID_MAPPING = {
     # hard code the mapping, it is implemented in different ways for TiffTag and piexif.ImageIFD,
     # but boils down to the same ids.
@@ -154,16 +588,99 @@ class TagDictionary:
 
         return tiff_info
 
+    def merge_exif_bytes(self, image_bytes):
+        """
+        Like construct_exif_bytes, but keep the exif data that is already in the jpeg (image_bytes).
+        The new tags replace existing tags with the same id.
+        """
+        exif_dict = piexif.load(image_bytes)
+        exif_dict['0th'].update(self.tag_dict)
+        return piexif.dump(exif_dict)
+
+    def insert_exif(self, image_file_path):
+        """
+        Put the tags in the exif segment (APP1) of the jpeg, without touching the compressed pixel data.
+        The new file is written next to the original, and then moved over it, so the image is never half written.
+        """
+        with open(image_file_path, 'rb') as image_file:
+            image_bytes = image_file.read()
+
+        output = io.BytesIO()
+        piexif.insert(self.merge_exif_bytes(image_bytes), image_bytes, output)
+
+        temporary_path = '{}.tags_tmp'.format(image_file_path)
+        with open(temporary_path, 'wb') as temporary_file:
+            temporary_file.write(output.getvalue())
+        shutil.copystat(image_file_path, temporary_path)
+        os.replace(temporary_path, image_file_path)
+
+    def patch_tiff_tags(self, image_file_path):
+        """
+        Add the tags to the first IFD (the tag directory) of a tiff file, without touching the pixel data.
+
+        All existing entries are copied as they are (their values stay where they are in the file), the new tags
+        replace entries with the same id. The new IFD and the new tag values are appended to the end of the file,
+        and only then the header is changed to point to the new IFD. The old IFD stays in the file, unused.
+        This works for all tiff compressions, for classic and BigTIFF files, and for both byte orders.
+        """
+        with open(image_file_path, 'r+b') as image_file:
+            header = image_file.read(16)
+            byte_order = {b'II': '<', b'MM': '>'}[header[:2]]
+            big_tiff = struct.unpack(byte_order + 'H', header[2:4])[0] == 43
+
+            # the formats of: the number of entries, one entry (tag, type, count, value) and an offset
+            count_format, offset_format = ('Q', 'Q') if big_tiff else ('H', 'I')
+            entry_format = byte_order + ('HHQ8s' if big_tiff else 'HHI4s')
+            entry_size = struct.calcsize(entry_format)
+            inline_size = 8 if big_tiff else 4
+            header_pointer_position = 8 if big_tiff else 4
+
+            image_file.seek(header_pointer_position)
+            ifd_offset = struct.unpack(byte_order + offset_format, image_file.read(inline_size))[0]
+
+            image_file.seek(ifd_offset)
+            entry_count = struct.unpack(byte_order + count_format, image_file.read(struct.calcsize(count_format)))[0]
+            entries = {}
+            for _ in range(entry_count):
+                raw_entry = image_file.read(entry_size)
+                entries[struct.unpack(byte_order + 'H', raw_entry[:2])[0]] = raw_entry
+            next_ifd_offset = image_file.read(inline_size)  # keep the other pages of a multi page tiff
+
+            image_file.seek(0, os.SEEK_END)
+            for tag, value in self.tag_dict.items():
+                data = value if isinstance(value, bytes) else value.encode('ascii', errors='replace')
+                data += b'\0'
+                if len(data) > inline_size:
+                    if image_file.tell() % 2:
+                        image_file.write(b'\0')  # values should start on a word boundary
+                    value_field = struct.pack(byte_order + offset_format, image_file.tell())
+                    image_file.write(data)
+                else:
+                    value_field = data.ljust(inline_size, b'\0')
+                entries[tag] = struct.pack(entry_format, tag, 2, len(data), value_field)  # 2: ASCII
+
+            if image_file.tell() % 2:
+                image_file.write(b'\0')
+            new_ifd_offset = image_file.tell()
+            image_file.write(struct.pack(byte_order + count_format, len(entries)))
+            for tag in sorted(entries):  # entries should be sorted by tag
+                image_file.write(entries[tag])
+            image_file.write(next_ifd_offset)
+            image_file.flush()
+
+            image_file.seek(header_pointer_position)
+            image_file.write(struct.pack(byte_order + offset_format, new_ifd_offset))
+
     def save_tags(self, image_file_path):
-        image = Image.open(image_file_path)
+        """
+        Only the metadata is written, the pixels are not decoded and encoded again. Existing tags are kept.
+        """
+        image = Image.open(image_file_path)  # this only reads the header
         file_format = image.tile[0][0]
 
-        if file_format == 'jpeg':
-            image.save(image_file_path, format=JPEG_FORMAT, exif=self.construct_exif_bytes(), quality='keep')
-        elif file_format == 'libtiff':
-            image.save(image_file_path, format=TIFF_FORMAT, tiffinfo=self.construct_tiff_tags())
-        elif file_format == 'raw':
-            raise NotImplementedError(
-                'The file_format is \'{}\', probably a tiff file without compression'.format(file_format))
+        if image.format == JPEG_FORMAT:
+            self.insert_exif(image_file_path)
+        elif image.format == TIFF_FORMAT:
+            self.patch_tiff_tags(image_file_path)
         else:
             raise NotImplementedError('Could not save tags on this file format: {}'.format(file_format))
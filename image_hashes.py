@@ -0,0 +1,301 @@
+import json
+import math
+import os
+import re
+
+import numpy
+from PIL import Image
+
+from helpers import scan_directory, determine_new_file_path, IMAGE_EXTENSIONS
+
+HASH_SIZE = 8  # hashes are HASH_SIZE * HASH_SIZE = 64 bits
+DCT_SIZE = 32  # the dct hash is calculated on a 32 x 32 thumbnail, only the lowest 8 x 8 frequencies are used
+INDEX_FILE_NAME = '.image_hashes.json'
+SIMILAR_FOLDER_PATTERN = re.compile(r'similar_(\d+)$')
+
+
+def _load_thumbnails(file_paths: list, size: tuple):
+    """
+    Load all images as small grayscale thumbnails, in one numpy array with shape (len(file_paths), height, width).
+    For jpeg images, draft mode lets the decoder skip most of the pixels, which is a lot faster for large images.
+    """
+    thumbnails = numpy.empty((len(file_paths), size[1], size[0]), dtype=numpy.float32)
+    for index, file_path in enumerate(file_paths):
+        image = Image.open(file_path)
+        image.draft('L', size)
+        thumbnails[index] = numpy.asarray(image.convert('L').resize(size, Image.BILINEAR), dtype=numpy.float32)
+
+    return thumbnails
+
+
+def _dct_matrix(size: int):
+    """
+    The (orthonormal) DCT-II matrix. For a matrix of pixels X, the 2D dct is: D @ X @ D.T
+    """
+    k = numpy.arange(size).reshape(-1, 1)
+    n = numpy.arange(size).reshape(1, -1)
+    matrix = numpy.cos(math.pi * (2 * n + 1) * k / (2 * size)) * math.sqrt(2 / size)
+    matrix[0] /= math.sqrt(2)
+    return matrix.astype(numpy.float32)
+
+
+def _average_hash_bits(file_paths: list):
+    thumbnails = _load_thumbnails(file_paths, size=(HASH_SIZE, HASH_SIZE))
+    return thumbnails > thumbnails.mean(axis=(1, 2), keepdims=True)
+
+
+def _difference_hash_bits(file_paths: list):
+    # one extra column, so every row has HASH_SIZE differences between horizontal neighbours
+    thumbnails = _load_thumbnails(file_paths, size=(HASH_SIZE + 1, HASH_SIZE))
+    return thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+
+
+def _dct_hash_bits(file_paths: list):
+    thumbnails = _load_thumbnails(file_paths, size=(DCT_SIZE, DCT_SIZE))
+    dct_matrix = _dct_matrix(DCT_SIZE)
+
+    # matmul broadcasts over the first axis, so this calculates the dct for all thumbnails at once
+    low_frequencies = (dct_matrix @ thumbnails @ dct_matrix.T)[:, :HASH_SIZE, :HASH_SIZE]
+    coefficients = low_frequencies.reshape(len(file_paths), -1)
+
+    # leave out the first (DC) coefficient for the median, it is just the average brightness
+    medians = numpy.median(coefficients[:, 1:], axis=1).reshape(-1, 1)
+    return coefficients > medians
+
+
+HASH_FUNCTIONS = {
+    'average': _average_hash_bits,
+    'difference': _difference_hash_bits,
+    'dct': _dct_hash_bits,
+}
+
+
+def compute_image_hashes(file_paths: list, hash_type: str = 'difference', batch_size: int = 256):
+    """
+    Calculate a 64 bit perceptual hash for every image, return them as a list of integers.
+    Images that look alike will get hashes that only differ in a few bits (a small Hamming distance).
+
+    The thumbnails are processed in batches of 'batch_size' images, so the memory use stays small for large
+    directories.
+    """
+    hash_function = HASH_FUNCTIONS[hash_type]
+
+    hashes = []
+    for start in range(0, len(file_paths), batch_size):
+        bits = hash_function(file_paths[start:start + batch_size]).reshape(-1, HASH_SIZE * HASH_SIZE)
+        for packed in numpy.packbits(bits, axis=1):
+            hashes.append(int.from_bytes(packed.tobytes(), byteorder='big'))
+
+    return hashes
+
+
+def hamming_distance(hash_1: int, hash_2: int):
+    return bin(hash_1 ^ hash_2).count('1')
+
+
+class BKTree:
+    """
+    A Burkhard-Keller tree, to find all hashes within a Hamming distance, without comparing against every hash.
+
+    Every node has children keyed by their distance to the node. Because the Hamming distance is a metric,
+    a search for 'max_distance' around a hash only has to visit the children with a key between
+    distance - max_distance and distance + max_distance (triangle inequality).
+    """
+    def __init__(self):
+        self.root = None
+
+    def add(self, image_hash: int, item):
+        node = (image_hash, item, {})
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming_distance(image_hash, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, image_hash: int, max_distance: int):
+        """
+        Return a list of (distance, item) for all items within 'max_distance' of 'image_hash'.
+        """
+        results = []
+        nodes_to_visit = [self.root] if self.root is not None else []
+        while nodes_to_visit:
+            node_hash, item, children = nodes_to_visit.pop()
+            distance = hamming_distance(image_hash, node_hash)
+            if distance <= max_distance:
+                results.append((distance, item))
+
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes_to_visit.append(child)
+
+        return results
+
+
+class ImageHashIndex:
+    """
+    Perceptual hashes of all images in a directory, stored in a (hidden) json file in the same directory.
+    The file size and modification time are stored with every hash, when they did not change, the stored
+    hash is used, so only new or changed images are read when the index is updated.
+    """
+    def __init__(self, directory_path: str, hash_type: str = 'difference'):
+        self.directory_path = directory_path
+        self.hash_type = hash_type
+        self.index_path = os.path.join(directory_path, INDEX_FILE_NAME)
+        # {file name (or 'sub_folder/file name'): (file_size, modification_time, hash)}
+        self.hashes = {}
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                stored = json.load(index_file).get(hash_type, {})
+            self.hashes = {
+                file_name: (file_size, modification_time, int(image_hash, 16))
+                for file_name, (file_size, modification_time, image_hash) in stored.items()
+            }
+
+    def update(self, allowed_extensions: list = None, sub_folders: list = ()):
+        """
+        Bring the index up to date with the image files in the directory (and in the given sub folders, one level
+        deep), and save it. Return a dictionary {file_path: hash} of all images.
+        """
+        allowed_extensions = allowed_extensions or IMAGE_EXTENSIONS
+
+        hashes = {}
+        file_paths_to_hash = []
+        for sub_folder in [''] + list(sub_folders):
+            entries = scan_directory(
+                directory_path=os.path.join(self.directory_path, sub_folder), allowed_extensions=allowed_extensions,
+                include_directories=False)
+            for entry in entries:
+                file_name = os.path.join(sub_folder, entry.name) if sub_folder else entry.name
+                stat = entry.stat()
+                stored = self.hashes.get(file_name)
+                if stored is not None and stored[:2] == (stat.st_size, stat.st_mtime_ns):
+                    hashes[file_name] = stored
+                else:
+                    file_paths_to_hash.append((entry.path, file_name, stat))
+
+        new_hashes = compute_image_hashes([item[0] for item in file_paths_to_hash], hash_type=self.hash_type)
+        for (file_path, file_name, stat), image_hash in zip(file_paths_to_hash, new_hashes):
+            hashes[file_name] = (stat.st_size, stat.st_mtime_ns, image_hash)
+
+        self.hashes = hashes
+        self.save()
+
+        return {os.path.join(self.directory_path, file_name): value[2] for file_name, value in hashes.items()}
+
+    def move(self, file_name: str, new_file_name: str):
+        """
+        Keep the hash of a file that was moved (renaming keeps its size and modification time), instead of reading
+        it again on the next update. Call save() afterwards.
+        """
+        self.hashes[new_file_name] = self.hashes.pop(file_name)
+
+    def save(self):
+        stored = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                stored = json.load(index_file)
+
+        stored[self.hash_type] = {
+            file_name: (file_size, modification_time, '{:016x}'.format(image_hash))
+            for file_name, (file_size, modification_time, image_hash) in self.hashes.items()
+        }
+        temporary_path = '{}.tmp'.format(self.index_path)
+        with open(temporary_path, 'w') as index_file:
+            json.dump(stored, index_file)
+        os.replace(temporary_path, self.index_path)
+
+
+def group_similar_images(path_hashes: dict, max_distance: int = 4):
+    """
+    Take a dictionary {file_path: hash}, and return groups (sorted lists of file paths) of images that are
+    connected by hashes within 'max_distance' of each other. Only groups with more than one image are returned.
+    """
+    tree = BKTree()
+    for file_path, image_hash in path_hashes.items():
+        tree.add(image_hash, file_path)
+
+    # union find, so the groups are the connected components of all 'similar' pairs
+    parents = {file_path: file_path for file_path in path_hashes}
+
+    def find_root(file_path):
+        while parents[file_path] != file_path:
+            parents[file_path] = parents[parents[file_path]]
+            file_path = parents[file_path]
+        return file_path
+
+    for file_path, image_hash in path_hashes.items():
+        for distance, similar_file_path in tree.search(image_hash, max_distance=max_distance):
+            parents[find_root(similar_file_path)] = find_root(file_path)
+
+    groups = {}
+    for file_path in path_hashes:
+        groups.setdefault(find_root(file_path), []).append(file_path)
+
+    return sorted(sorted(group) for group in groups.values() if len(group) > 1)
+
+
+def sort_images_by_similarity(directory_path: str, hash_type: str = 'difference', max_distance: int = 4):
+    """
+    Find images that look (almost) the same, even when the files are not identical (for example renders
+    with slightly different parameters, or the same image saved with a different quality).
+    Every group of similar images is moved to a sub_folder 'similar_0', 'similar_1', etc.
+
+    'max_distance' is the number of bits (out of 64) that the perceptual hashes of two images may differ. 0 only
+    finds images that are practically identical, above 10 unrelated images will start to be grouped together.
+
+    The hashes are stored in a hidden file in the directory, so running this again only reads the new images.
+    The images in existing 'similar_' folders are compared as well: a new image that is similar to a group is moved
+    into its folder, and groups that become connected by a new image are merged into the first folder.
+    """
+    group_folders = sorted(
+        (entry.name for entry in scan_directory(directory_path) if entry.is_dir()
+         and SIMILAR_FOLDER_PATTERN.match(entry.name)),
+        key=lambda name: int(SIMILAR_FOLDER_PATTERN.match(name).group(1)))
+    next_folder_number = max((int(SIMILAR_FOLDER_PATTERN.match(name).group(1)) for name in group_folders),
+                             default=-1) + 1
+
+    index = ImageHashIndex(directory_path=directory_path, hash_type=hash_type)
+    path_hashes = index.update(sub_folders=group_folders)
+
+    for file_paths in group_similar_images(path_hashes, max_distance=max_distance):
+        file_names = [os.path.relpath(file_path, directory_path) for file_path in file_paths]
+        existing_folders = [folder for folder in group_folders
+                            if any(os.path.dirname(file_name) == folder for file_name in file_names)]
+        if all(os.path.dirname(file_name) for file_name in file_names) and len(existing_folders) == 1:
+            continue  # an existing group, without new images
+
+        if existing_folders:
+            folder = existing_folders[0]
+        else:
+            folder = 'similar_{}'.format(next_folder_number)
+            next_folder_number += 1
+            os.mkdir(os.path.join(directory_path, folder))
+
+        for file_name in file_names:
+            if os.path.dirname(file_name) == folder:
+                continue
+            new_file_name = os.path.join(folder, os.path.basename(file_name))
+            new_file_path = os.path.join(directory_path, new_file_name)
+            if os.path.exists(new_file_path):
+                # a file with the same name from another group folder
+                new_file_path = determine_new_file_path(new_file_path)
+                new_file_name = os.path.relpath(new_file_path, directory_path)
+            os.rename(os.path.join(directory_path, file_name), new_file_path)
+            index.move(file_name, new_file_name)
+
+        for merged_folder in existing_folders[1:]:
+            if not os.listdir(os.path.join(directory_path, merged_folder)):
+                os.rmdir(os.path.join(directory_path, merged_folder))
+
+    index.save()
+
+
+sort_images_by_similarity.combo_choices = {'hash_type': list(HASH_FUNCTIONS)}
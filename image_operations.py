@@ -1,10 +1,20 @@
 import os
 import random
+import re
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 
 from PIL import Image, ImageFilter, ImageChops, ImageDraw, ImageOps
 
-from helpers import split_file_path, save_image, TagDictionary, get_new_file_path
+from helpers import (
+    split_file_path, save_image, TagDictionary, get_new_file_path, reduce_image_for_size, scan_directory,
+    determine_new_file_path, StripTiffWriter, encode_image, lossless_jpeg_transform, is_mcu_aligned, JPEG_FORMAT,
+    open_image, jpeg_transform_backend,
+)
+from tracing import traced
+
+CONTACT_SHEET_FILE_NAME = 'contact_sheet.tif'
+CONTACT_SHEET_NAME_PATTERN = re.compile(r'contact_sheet(\(\d+\))?\.tif$', re.IGNORECASE)
 
 
 class Colors:
@@ -13,31 +23,62 @@ class Colors:
     white = (255, 255, 255)
 
 
-def resize_image(file_path: str, new_width: int = 1080, new_height: int = 1080, resample: str = 'LANCZOS'):
+def _calculate_new_size(original_size: tuple, new_width: int, new_height: int):
+    original_width, original_height = original_size
+    if new_width == 0 and new_height > 0:
+        new_width = int(original_width * new_height / original_height)
+    elif new_height == 0 and new_width > 0:
+        new_height = int(original_height * new_width / original_width)
+    elif not(new_height > 0 and new_width > 0):
+        return
+
+    return new_width, new_height
+
+
+@traced
+def _resize_image(image, new_width: int = 1080, new_height: int = 1080, resample: str = 'LANCZOS'):
+    new_size = _calculate_new_size(image.size, new_width=new_width, new_height=new_height)
+    if new_size is None:
+        return
+
+    return image.resize(size=new_size, resample=getattr(Image, resample))
+
+
+@traced
+def resize_image(
+    file_path: str,
+    new_width: int = 1080,
+    new_height: int = 1080,
+    resample: str = 'LANCZOS',
+    exact_decode: bool = False,
+):
     """
     Resize the image to the given dimensions (new_width, new_height).
 
     If the new_width is 0, and the new_height is a positive value, calculate a value for the width in such way
     that the original ratio is maintained, and the new_height is exactly the given new_height.
     Do the same if the new_height is 0 and the new_width a positive value.
-    """
-    image = Image.open(file_path)
 
-    original_width, original_height = image.size
-    if new_width == 0 and new_height > 0:
-        new_width = int(original_width * new_height / original_height)
-    elif new_height == 0 and new_width > 0:
-        new_height = int(original_height * new_width / original_width)
-    elif not(new_height > 0 and new_width > 0):
+    When the image is scaled down a lot, a jpeg is decoded at a reduced size (see reduce_image_for_size),
+    check 'exact_decode' to always decode the full resolution image first.
+    """
+    image = open_image(file_path)
+    new_size = _calculate_new_size(image.size, new_width=new_width, new_height=new_height)
+    if new_size is None:
         return
 
-    image = image.resize(size=(new_width, new_height), resample=getattr(Image, resample))
+    if not exact_decode:
+        image = reduce_image_for_size(image, size=new_size)
+
+    image = _resize_image(image, new_width=new_size[0], new_height=new_size[1], resample=resample)
+
     return save_image(
         pil_image=image,
         new_file_path=get_new_file_path(file_path, post_fix_filename='resized'),
     )
 
 
+resize_image.image_operation = _resize_image
 resize_image.combo_choices = {'resample': [
     # these are defined as integers in PIL (Image.LANCZOS = 1). For readability and ease in the combo boxes,
     # these string values are used. Note that ANTIALIAS is exactly the same as LANCZOS
@@ -45,6 +86,22 @@ resize_image.combo_choices = {'resample': [
 ]}
 
 
+@traced
+def _add_margin(original_image, margin: int = 100, background_color: tuple = Colors.black):
+    original_width, original_height = original_image.size
+
+    new_image = Image.new(mode=original_image.mode, size=original_image.size, color=background_color)
+
+    original_image = original_image.resize(
+        size=(original_width - 2 * margin, original_height - 2 * margin),
+        resample=Image.LANCZOS,
+    )
+    new_image.paste(im=original_image, box=(margin, margin))
+
+    return new_image
+
+
+@traced
 def add_margin(
     file_path: str,
     margin: int = 100,
@@ -55,25 +112,24 @@ def add_margin(
     image, that has the same dimensions as the original image, but with an equal margin on all sides around
     the (resized) original image.
     """
-    original_image = Image.open(file_path)
-    original_width, original_height = original_image.size
-
-    new_image = Image.new(mode=original_image.mode, size=original_image.size, color=background_color)
-
-    original_image = original_image.resize(
-        size=(original_width - 2 * margin, original_height - 2 * margin),
-        resample=Image.LANCZOS,
-    )
-    new_image.paste(im=original_image, box=(margin, margin))
+    new_image = _add_margin(open_image(file_path), margin=margin, background_color=background_color)
 
     new_file_path = get_new_file_path(file_path, post_fix_filename='with_margin{}'.format(margin))
     return save_image(pil_image=new_image, new_file_path=new_file_path)
 
 
+add_margin.image_operation = _add_margin
 add_margin.color_parameters = ('background_color', )
 
 
-def calculate_box_tuples(width: int, height: int, x: int = 2, y: int = 2):
+def calculate_box_tuples(
+    width: int,
+    height: int,
+    x: int = 2,
+    y: int = 2,
+    tile_width: int = 0,
+    tile_height: int = 0,
+):
     """
     Cut an image in equal rectangular parts.
 
@@ -90,9 +146,21 @@ def calculate_box_tuples(width: int, height: int, x: int = 2, y: int = 2):
     The steps will be rounded integer values. All parts will have equal dimensions, except the ones that are on the
     right or bottom. They will get their 'edge' coordinate to equal the width and/or height of the original image,
     so no data will be lost. This will make up for the rounding.
+
+    When a 'tile_width' is given, the parts get this fixed width instead, and x is calculated. The parts on the right
+    then get the remaining width (which is smaller than the tile_width). The same goes for 'tile_height' and y.
     """
-    x_step = int(width / x)
-    y_step = int(height / y)
+    if tile_width > 0:
+        x = -(-width // tile_width)  # round up
+        x_step = tile_width
+    else:
+        x_step = int(width / x)
+
+    if tile_height > 0:
+        y = -(-height // tile_height)
+        y_step = tile_height
+    else:
+        y_step = int(height / y)
 
     box_tuples = []
     for x_index in range(x):
@@ -119,26 +187,74 @@ def calculate_box_tuples(width: int, height: int, x: int = 2, y: int = 2):
     return box_tuples
 
 
-def crop_image_in_equal_parts(file_path: str, x: int = 2, y: int = 2):
+@traced
+def crop_image_in_equal_parts(
+    file_path: str,
+    x: int = 2,
+    y: int = 2,
+    tile_width: int = 0,
+    tile_height: int = 0,
+    max_workers: int = None,
+    lossless: bool = True,
+):
     """
-    Take an image, and save x * y cropped parts of the image
+    Take an image, and save x * y cropped parts of the image.
+    With a 'tile_width' and/or 'tile_height', cut the image in parts of that size instead (see calculate_box_tuples).
+
+    The image is decoded once. The parts are encoded in a pool of 'max_workers' threads (by default one per core,
+    Pillow releases the GIL while encoding), and the encoded parts are written to disk afterwards.
+
+    When 'lossless' is checked, and all parts of a jpeg start on the jpeg block boundaries (for example with a
+    tile_width and tile_height that are a multiple of 16), the parts are cropped with jpegtran instead, without
+    decoding the image at all (see lossless_jpeg_transform).
     """
-    image = Image.open(file_path)
+    image = open_image(file_path)
     directory, file_name, extension = split_file_path(file_path)
 
-    width, height = image.width, image.height
+    box_tuples = calculate_box_tuples(image.width, image.height, x=x, y=y, tile_width=tile_width,
+                                      tile_height=tile_height)
+    new_file_paths = [
+        os.path.join(directory, '{}_crop{}.{}'.format(file_name, index, extension)) for index in range(len(box_tuples))
+    ]
+
+    if lossless and image.format == JPEG_FORMAT and all(is_mcu_aligned(image, box) for box in box_tuples):
+        def crop_part(box, new_file_path):
+            crop_argument = '{}x{}+{}+{}'.format(box[2] - box[0], box[3] - box[1], box[0], box[1])
+            return lossless_jpeg_transform(file_path, new_file_path, arguments=['-crop', crop_argument])
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            lossless_file_paths = list(executor.map(crop_part, box_tuples, new_file_paths))
+
+        if None not in lossless_file_paths:
+            return lossless_file_paths
+
+        # jpegtran is not installed, or failed: remove the parts that were made, and do it the normal way
+        for lossless_file_path in lossless_file_paths:
+            if lossless_file_path is not None:
+                os.unlink(lossless_file_path)
+
+    image.load()  # decode once, before the threads start cropping
+
+    def encode_part(dimensions):
+        return encode_image(image.crop(dimensions), image_format=image.format)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        encoded_parts = list(executor.map(encode_part, box_tuples))
 
     new_file_names = []
-    for index, dimensions in enumerate(calculate_box_tuples(width, height, x=x, y=y)):
-        cropped_image = image.crop(dimensions)
+    for new_file_path, encoded_part in zip(new_file_paths, encoded_parts):
+        if os.path.exists(new_file_path):
+            new_file_path = determine_new_file_path(new_file_path)
 
-        new_file_path = os.path.join(directory, '{}_crop{}.{}'.format(file_name, index, extension))
-        save_image(pil_image=cropped_image, new_file_path=new_file_path, image_format=image.format)
+        with open(new_file_path, 'wb') as new_file:
+            new_file.write(encoded_part)
         new_file_names.append(new_file_path)
 
     return new_file_names
 
 
+crop_image_in_equal_parts.transform_backend = jpeg_transform_backend
+
 def get_resize_ratio(image_width: int, image_height: int, new_image_size: tuple):
     # if needed, resize the image first
     resize_ratio = 1
@@ -153,22 +269,14 @@ def get_resize_ratio(image_width: int, image_height: int, new_image_size: tuple)
     return resize_ratio
 
 
-def paste_image_in_center(
-    file_path: str,
+@traced
+def _paste_image_in_center(
+    image,
     new_image_width: int = 1920,
     new_image_height: int = 1080,
     background_color: tuple = Colors.white,
 ):
-    """
-    Paste the original image in a new frame with the given dimensions.
-    Add margin around the image, such that the original image will be in the center.
-
-    When the original image is larger then the new desired dimensions, resize the original image first.
-
-    Example use case if an square image should be pasted on another specific format, like a 13:9 YouTube still
-    """
     new_image_size = (new_image_width, new_image_height)
-    image = Image.open(file_path)
     image_width = image.width
     image_height = image.height
 
@@ -187,67 +295,158 @@ def paste_image_in_center(
     new_image = Image.new(mode=image.mode, size=new_image_size, color=background_color)
     new_image.paste(im=image, box=(delta_x, delta_y))
 
-    new_file_path = get_new_file_path(
-        file_path, post_fix_filename='centered{}x{}'.format(new_image_size[0], new_image_size[1]))
-    return save_image(pil_image=new_image, new_file_path=new_file_path, image_format=image.format)
+    return new_image
 
 
-paste_image_in_center.color_parameters = ('background_color', )
+@traced
+def paste_image_in_center(
+    file_path: str,
+    new_image_width: int = 1920,
+    new_image_height: int = 1080,
+    background_color: tuple = Colors.white,
+    exact_decode: bool = False,
+):
+    """
+    Paste the original image in a new frame with the given dimensions.
+    Add margin around the image, such that the original image will be in the center.
 
+    When the original image is larger then the new desired dimensions, resize the original image first.
+    In that case a jpeg is decoded at a reduced size, unless 'exact_decode' is checked.
 
-def crop_center(file_path: str, new_width: int = 1080, new_height: int = 1080):
-    """
-    Crop a new image of dimensions (new_width, new_height) from the center of the original image
-    (equal margins left over on all sides)
+    Example use case if an square image should be pasted on another specific format, like a 13:9 YouTube still
     """
-    image = Image.open(file_path)
+    image = open_image(file_path)
+    image_format = image.format
 
-    if image.width < new_width or image.height < new_height:
+    resize_ratio = get_resize_ratio(
+        image_width=image.width, image_height=image.height, new_image_size=(new_image_width, new_image_height)
+    )
+    if resize_ratio != 1 and not exact_decode:
+        # resize to the final dimensions here, from the reduced image. The image will then fit in the new frame.
+        new_size = (int(resize_ratio * image.width), int(resize_ratio * image.height))
+        image = reduce_image_for_size(image, size=new_size).resize(new_size, Image.LANCZOS)
+
+    new_image = _paste_image_in_center(
+        image, new_image_width=new_image_width, new_image_height=new_image_height, background_color=background_color)
+
+    new_file_path = get_new_file_path(
+        file_path, post_fix_filename='centered{}x{}'.format(new_image_width, new_image_height))
+    return save_image(pil_image=new_image, new_file_path=new_file_path, image_format=image_format)
+
+
+paste_image_in_center.image_operation = _paste_image_in_center
+paste_image_in_center.color_parameters = ('background_color', )
+
+
+def _get_center_box(image_size: tuple, new_width: int, new_height: int):
+    width, height = image_size
+    if width < new_width or height < new_height:
         return
 
-    diff_x = image.width - new_width
-    diff_y = image.height - new_height
+    diff_x = width - new_width
+    diff_y = height - new_height
 
     left = int(diff_x / 2)
     right = int(diff_x / 2) + new_width
     top = int(diff_y / 2)
     bottom = int(diff_y / 2) + new_height
 
-    image = image.crop((left, top, right, bottom))
+    return left, top, right, bottom
+
+
+@traced
+def _crop_center(image, new_width: int = 1080, new_height: int = 1080):
+    box = _get_center_box(image.size, new_width=new_width, new_height=new_height)
+    if box is None:
+        return
+
+    return image.crop(box)
+
+
+@traced
+def crop_center(file_path: str, new_width: int = 1080, new_height: int = 1080, lossless: bool = True):
+    """
+    Crop a new image of dimensions (new_width, new_height) from the center of the original image
+    (equal margins left over on all sides)
 
+    When 'lossless' is checked, a jpeg is cropped without decoding and encoding it again (see
+    lossless_jpeg_transform), when possible: jpegtran should be installed, and the left and top of the cropped area
+    should be on the jpeg block boundaries. Otherwise the image is cropped in the normal way.
+    """
+    image = open_image(file_path)
     new_file_path = get_new_file_path(file_path, post_fix_filename='cropped_center')
-    return save_image(pil_image=image, new_file_path=new_file_path)
 
+    box = _get_center_box(image.size, new_width=new_width, new_height=new_height)
+    if box is None:
+        return
+
+    if lossless and image.format == JPEG_FORMAT and is_mcu_aligned(image, box):
+        crop_argument = '{}x{}+{}+{}'.format(new_width, new_height, box[0], box[1])
+        lossless_file_path = lossless_jpeg_transform(file_path, new_file_path, arguments=['-crop', crop_argument])
+        if lossless_file_path is not None:
+            return lossless_file_path
+
+    return save_image(pil_image=image.crop(box), new_file_path=new_file_path)
+
+
+crop_center.image_operation = _crop_center
+crop_center.transform_backend = jpeg_transform_backend  # see result_cache.py
+
+
+def make_random_filter(random_seed: str):
+    """
+    Return a random 3x3 filter. The same seed always gives the same filter.
+    A generator of its own is used (not the global one), so filters made in threads at the same time still match
+    their seeds.
+    """
+    generator = random.Random(random_seed)
+
+    class RandomFilter(ImageFilter.BuiltinFilter):
+        name = "Random"
+        filterargs = (3, 3), generator.randint(0, 6), generator.randint(6, 256), (
+            generator.randint(-10, 10), generator.randint(-10, 10), generator.randint(-10, 10),
+            generator.randint(-10, 10), generator.randint(-10, 10), generator.randint(-10, 10),
+            generator.randint(-10, 10), generator.randint(-10, 10), generator.randint(-10, 10),
+        )
 
-def apply_filter(file_path: str, filter_name: str = 'BLUR', save_both_images: bool = False):
+    return RandomFilter
+
+
+@traced
+def _apply_filter(original_image, filter_name: str = 'BLUR', random_seed: str = None):
+    """
+    When the filter_name is 'random' and no random_seed is given, a new seed is taken from the current time.
+    """
+    if filter_name == 'random':
+        if random_seed is None:
+            random_seed = str(time()).split('.')[-1]
+        return original_image.filter(filter=make_random_filter(random_seed))
+
+    return original_image.filter(filter=getattr(ImageFilter, filter_name))
+
+
+@traced
+def apply_filter(file_path: str, filter_name: str = 'BLUR', save_both_images: bool = False, random_seed: str = ''):
     """
     Apply the selected filter to the image(s).
     If save_both_images is False, save a new file that is the original file post fixed with the filter_name.
     If save_both_image is True, save a new file with the two images next to each other, left the original,
     right the one with the filter applied.
+
+    For the 'random' filter, the seed is post fixed to the file name. Provide that 'random_seed' to apply the same
+    random filter again, when it is empty a new seed is used.
     """
     directory, file_name, extension = split_file_path(file_path)
-    original_image = Image.open(file_path)
+    original_image = open_image(file_path)
 
     random_seed_str = ''  # will be post fixed to the filename, but should be empty when random is not used
     if filter_name == 'random':
         # set a different seed at every function call, so when this is called for an entire directory, a different
         # random filter will be applied for every image. Save the seed in the image name, so it can be reproduced.
-        random_seed = str(time()).split('.')[-1]
+        random_seed = random_seed or str(time()).split('.')[-1]
         random_seed_str = '_seed{}'.format(random_seed)
-        random.seed(random_seed)
-
-        class RandomFilter(ImageFilter.BuiltinFilter):
-            name = "Random"
-            filterargs = (3, 3), random.randint(0, 6), random.randint(6, 256), (
-                random.randint(-10, 10), random.randint(-10, 10), random.randint(-10, 10),
-                random.randint(-10, 10), random.randint(-10, 10), random.randint(-10, 10),
-                random.randint(-10, 10), random.randint(-10, 10), random.randint(-10, 10),
-            )
-        filtered_image = original_image.filter(filter=RandomFilter)
-    else:
-        pil_filter = getattr(ImageFilter, filter_name)
-        filtered_image = original_image.filter(filter=pil_filter)
+
+    filtered_image = _apply_filter(original_image, filter_name=filter_name, random_seed=random_seed or None)
 
     new_file_path = os.path.join(directory, '{}_{}{}.{}'.format(file_name, filter_name, random_seed_str, extension))
 
@@ -267,26 +466,32 @@ def apply_filter(file_path: str, filter_name: str = 'BLUR', save_both_images: bo
         return save_image(pil_image=filtered_image, new_file_path=new_file_path, image_format=original_image.format)
 
 
+apply_filter.image_operation = _apply_filter
 apply_filter.combo_choices = {'filter_name': (
     'FIND_EDGES', 'BLUR', 'CONTOUR', 'DETAIL', 'EDGE_ENHANCE', 'EDGE_ENHANCE_MORE', 'EMBOSS', 'SHARPEN', 'SMOOTH',
     'SMOOTH_MORE', 'random')
 }
+# a random filter without a seed gives a different result every time, see result_cache.py
+apply_filter.cacheable = lambda params: (
+    (params['filter_name'] != 'random' or bool(params['random_seed'])) and not params['save_both_images'])
 
 
+@traced
 def image_difference(file_paths: list):
     """
     Take two images, and calculate and save the difference between them with ImageChops.difference
     """
     assert len(file_paths) == 2, 'Please select exactly 2 files (only).'
 
-    image_1 = Image.open(file_paths[0])
-    image_2 = Image.open(file_paths[1])
+    image_1 = open_image(file_paths[0])
+    image_2 = open_image(file_paths[1])
     difference = ImageChops.difference(image_1, image_2)
 
     new_file_path = get_new_file_path(file_paths[0], post_fix_filename='diff')
     return save_image(pil_image=difference, new_file_path=new_file_path, image_format=image_1.format)
 
 
+@traced
 def save_image_tags(
     file_path: str,
     artist: str = '',
@@ -301,8 +506,8 @@ def save_image_tags(
 
     When leaving inputs blank, they will not be saved.
 
-    Important: Existing exif data will be overridden! So this is only useful to add a few image tags to
-    images without any tags.
+    Only the metadata in the file is changed, the image itself is not encoded again (so there is no loss of quality).
+    Existing tags are kept, except the ones that are provided here, they will be replaced.
 
     Important: When applying other image operations, the exif data could get lost on a new image save (for example
     when a new image was created). So adding exif data makes sense on a final image file that will not be adjusted more.
@@ -324,6 +529,42 @@ def save_image_tags(
     ).save_tags(image_file_path=file_path)
 
 
+@traced
+def save_image_tags_in_directory(
+    directory_path: str,
+    artist: str = '',
+    copyright: str = '',
+    software: str = '',
+    image_description: str = '',
+    datetime: str = '',
+    max_workers: int = 8,
+):
+    """
+    Save the same metadata on all jpeg and tiff files in the directory (see save_image_tags).
+    Writing the tags is mostly waiting for the disk, so the files are handled in a pool of 'max_workers' threads.
+
+    Return the number of files that were tagged.
+    """
+    tag_dictionary = TagDictionary(
+        artist=artist or None,
+        copyright=copyright or None,
+        software=software or None,
+        image_description=image_description or None,
+        datetime=datetime or None,
+    )
+    file_paths = [
+        entry.path for entry in scan_directory(
+            directory_path=directory_path, allowed_extensions=['jpeg', 'jpg', 'tif', 'tiff'], include_directories=False)
+    ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() to raise the first exception, if any
+        list(executor.map(tag_dictionary.save_tags, file_paths))
+
+    return len(file_paths)
+
+
+@traced
 def _blur_edges(original_image, radius: int = 20, background_color: tuple = Colors.white):
     double_radius = 2 * radius
     original_width, original_height = original_image.size
@@ -344,17 +585,20 @@ def _blur_edges(original_image, radius: int = 20, background_color: tuple = Colo
     return new_image
 
 
+@traced
 def blur_edges(file_path: str, radius: int = 20, background_color: tuple = Colors.white):
-    original_image = Image.open(file_path)
+    original_image = open_image(file_path)
     background = _blur_edges(original_image, radius=radius, background_color=background_color)
 
     new_file_path = get_new_file_path(file_path, post_fix_filename='blurred_edge')
     return save_image(pil_image=background, new_file_path=new_file_path)
 
 
+blur_edges.image_operation = _blur_edges
 blur_edges.color_parameters = ('background_color', )
 
 
+@traced
 def put_images_on_wall(
     file_paths: list,
     wall_color: tuple = Colors.white,
@@ -365,6 +609,8 @@ def put_images_on_wall(
     frame: str = 'None',
     frame_width: int = 30,
     frame_color: tuple = Colors.black,
+    max_image_height: int = 0,
+    exact_decode: bool = False,
 ):
     """
     Generate one image file, that contains all provided images pasted next to each other, with the provided spaces
@@ -382,6 +628,10 @@ def put_images_on_wall(
     Half the 'space_between_two_images' will be applied to the left and the right side of the image.
 
     When this is called with one single file, a frame and margin will be added.
+
+    When 'max_image_height' is greater than 0, images that are taller will be scaled down to this height first
+    (keeping their ratio). This makes it possible to put many large images on one wall, like an overview of
+    thumbnails. Jpeg images are then decoded at a reduced size, unless 'exact_decode' is checked.
     """
     add_frame = frame in ['Colored Frame', 'Blur'] and frame_width > 0
 
@@ -392,7 +642,13 @@ def put_images_on_wall(
     # Put the opened images in a list, so we don't have to open them again.
     # When a file_path is not an image, it will fail here, before we create a new image.
     for file_path in file_paths:
-        image = Image.open(fp=file_path)
+        image = open_image(file_path)
+        if 0 < max_image_height < image.height:
+            new_size = _calculate_new_size(image.size, new_width=0, new_height=max_image_height)
+            if not exact_decode:
+                image = reduce_image_for_size(image, size=new_size)
+            image = image.resize(size=new_size, resample=Image.LANCZOS)
+
         pil_image_list.append(image)
 
         image_widths.append(image.width)
@@ -453,12 +709,115 @@ put_images_on_wall.combo_choices = {'vertical_align': ['top', 'center', 'bottom'
 put_images_on_wall.combo_choices = {'frame': ['None', 'Colored Frame', 'Blur']}
 
 
+def _make_contact_sheet_cell(file_path: str, cell_size: tuple):
+    """
+    Open the image at a reduced size, and scale it to fit in the cell (keeping the ratio).
+    """
+    image = open_image(file_path)
+    ratio = min(cell_size[0] / image.width, cell_size[1] / image.height)
+    new_size = (max(1, int(image.width * ratio)), max(1, int(image.height * ratio)))
+
+    image = reduce_image_for_size(image, size=new_size)
+    return image.convert('RGB').resize(size=new_size, resample=Image.LANCZOS)
+
+
+@traced
+def make_contact_sheet(
+    directory_path: str,
+    image_extension: str = 'jpeg',
+    columns: int = 20,
+    cell_width: int = 256,
+    cell_height: int = 0,
+    space_between_images: int = 10,
+    background_color: tuple = Colors.white,
+):
+    """
+    Make one overview image of all images in the directory with the given 'image_extension' (sorted naturally,
+    so frame9 comes before frame10), laid out on a grid of 'columns' columns. Every image is scaled to fit in a
+    cell of (cell_width, cell_height), if the cell_height is 0, it is calculated from the ratio of the first image.
+
+    This works for any number of images: the sheet is rendered one row of images at a time, and every row is
+    written to the file directly. Only one row is in memory, and every image is decoded at a reduced size.
+    The sheet is saved as an uncompressed TIFF file (a BigTIFF when it is larger than 4 GB), named contact_sheet.tif
+    Earlier contact sheets in the directory (contact_sheet.tif, contact_sheet(0).tif, ...) are not put on the sheet.
+    """
+    file_paths = [
+        entry.path for entry in scan_directory(
+            directory_path=directory_path, allowed_extensions=[image_extension.lower()], sort='natural',
+            include_directories=False)
+        if not CONTACT_SHEET_NAME_PATTERN.match(entry.name)
+    ]
+    if not file_paths:
+        return
+
+    if cell_height == 0:
+        first_image = open_image(file_paths[0])
+        cell_height = max(1, int(cell_width * first_image.height / first_image.width))
+
+    rows = -(-len(file_paths) // columns)  # round up
+    row_height = cell_height + space_between_images
+    sheet_width = columns * (cell_width + space_between_images) + space_between_images
+    sheet_height = rows * row_height + space_between_images
+
+    new_file_path = os.path.join(directory_path, CONTACT_SHEET_FILE_NAME)
+    if os.path.exists(new_file_path):
+        new_file_path = determine_new_file_path(new_file_path)
+
+    with StripTiffWriter(new_file_path, width=sheet_width, height=sheet_height, rows_per_strip=row_height) as writer:
+        for row_index in range(rows):
+            # every strip has the space above the images in this row, the last strip is the space at the bottom
+            strip = Image.new(mode='RGB', size=(sheet_width, row_height), color=background_color)
+
+            for column_index, file_path in enumerate(file_paths[row_index * columns:(row_index + 1) * columns]):
+                cell = _make_contact_sheet_cell(file_path, cell_size=(cell_width, cell_height))
+
+                # center the image in its cell
+                top_x = space_between_images + column_index * (cell_width + space_between_images)
+                top_x += (cell_width - cell.width) // 2
+                top_y = space_between_images + (cell_height - cell.height) // 2
+                strip.paste(im=cell, box=(top_x, top_y))
+
+            writer.write_strip(strip)
+
+        if space_between_images > 0:
+            writer.write_strip(
+                Image.new(mode='RGB', size=(sheet_width, space_between_images), color=background_color))
+
+    return new_file_path
+
+
+make_contact_sheet.color_parameters = ('background_color', )
+
+
+@traced
+def _rotate_image(
+    image,
+    angle_in_degrees: float = 90.0,
+    background_color: tuple = (255, 255, 255),
+    expand: bool = False,
+    point_of_rotation: str = 'center',
+):
+    # when the center is None, Pil Image.rotate will use the image center as the default.
+    center = (0, 0) if point_of_rotation == 'top_left' else None
+
+    return image.rotate(
+        angle=angle_in_degrees,
+        # resample=1,  # default is 1: NEAREST
+        expand=expand,
+        center=center,
+        translate=None,  # optional translation to be applied after the rotation
+        fillcolor=background_color,
+    )
+
+
+@traced
 def rotate_image(
     file_path: str,
     angle_in_degrees: float = 90.0,
     background_color: tuple = (255, 255, 255),
     expand: bool = False,
     point_of_rotation: str = 'center',
+    lossless: bool = True,
 ):
     """
     Rotate the image (around the image center) and save as a new image file.
@@ -470,29 +829,77 @@ def rotate_image(
     the original image (for all other angles than 0, 90, 180, 270, 360).
 
     The empty space will be filled with the 'background_color'.
-    """
-    image = Image.open(fp=file_path)
 
-    # when the center is None, Pil Image.rotate will use the image center as the default.
-    center = (0, 0) if point_of_rotation == 'top_left' else None
+    When 'lossless' is checked, jpeg images that are rotated by 90, 180 or 270 degrees around the center are
+    rotated without decoding and encoding them again (see lossless_jpeg_transform), when that is possible.
+    For 90 and 270 degrees this only applies when the result is entirely visible ('expand' or a square image).
+    """
+    image = open_image(file_path)
+    new_file_path = get_new_file_path(file_path, post_fix_filename='rotated{}'.format(angle_in_degrees))
 
-    rotated_image = image.rotate(
-        angle=angle_in_degrees,
-        # resample=1,  # default is 1: NEAREST
+    angle = angle_in_degrees % 360
+    if (lossless and image.format == JPEG_FORMAT and angle in (90, 180, 270) and point_of_rotation == 'center'
+            and (expand or angle == 180 or image.width == image.height)):
+        # PIL rotates counter clockwise, jpegtran clockwise
+        clockwise_angle = str(int(360 - angle))
+        lossless_file_path = lossless_jpeg_transform(file_path, new_file_path, arguments=['-rotate', clockwise_angle])
+        if lossless_file_path is not None:
+            return lossless_file_path
+
+    rotated_image = _rotate_image(
+        image,
+        angle_in_degrees=angle_in_degrees,
+        background_color=background_color,
         expand=expand,
-        center=center,
-        translate=None,  # optional translation to be applied after the rotation
-        fillcolor=background_color,
+        point_of_rotation=point_of_rotation,
     )
-
-    new_file_path = get_new_file_path(file_path, post_fix_filename='rotated{}'.format(angle_in_degrees))
     return save_image(pil_image=rotated_image, new_file_path=new_file_path)
 
 
+rotate_image.image_operation = _rotate_image
+rotate_image.transform_backend = jpeg_transform_backend
 rotate_image.color_parameters = ('background_color',)
 rotate_image.combo_choices = {'point_of_rotation': ['center', 'top_left']}
 
 
+@traced
+def _flip_image(image, direction: str = 'horizontal'):
+    if direction == 'vertical':
+        return ImageOps.flip(image)
+    return ImageOps.mirror(image)
+
+
+@traced
+def flip_image(file_path: str, direction: str = 'horizontal', lossless: bool = True):
+    """
+    Mirror the image horizontally (left becomes right) or vertically (top becomes bottom).
+
+    When 'lossless' is checked, a jpeg is flipped without decoding and encoding it again
+    (see lossless_jpeg_transform), when that is possible.
+    """
+    image = open_image(file_path)
+    new_file_path = get_new_file_path(file_path, post_fix_filename='flipped_{}'.format(direction))
+
+    if lossless and image.format == JPEG_FORMAT:
+        lossless_file_path = lossless_jpeg_transform(file_path, new_file_path, arguments=['-flip', direction])
+        if lossless_file_path is not None:
+            return lossless_file_path
+
+    return save_image(pil_image=_flip_image(image, direction=direction), new_file_path=new_file_path)
+
+
+flip_image.image_operation = _flip_image
+flip_image.transform_backend = jpeg_transform_backend
+flip_image.combo_choices = {'direction': ['horizontal', 'vertical']}
+
+
+@traced
+def _grayscale(image, convert_mode: str = 'L'):
+    # ImageOps.grayscale(image) seemed like a good alternative, but it just calls image.convert("L")
+    return image.convert(convert_mode)
+
+
+@traced
 def grayscale(file_path: str, convert_mode: str = 'L'):
     """
     Convert the image to grayscale and save as a new image file.
@@ -503,16 +910,37 @@ def grayscale(file_path: str, convert_mode: str = 'L'):
 
     L and LA give a smooth result, '1' results in visible individual pixels
     """
-    image = Image.open(file_path).convert(convert_mode)
-    # ImageOps.grayscale(image) seemed like a good alternative, but it just calls image.convert("L")
+    image = _grayscale(open_image(file_path), convert_mode=convert_mode)
 
     new_file_path = get_new_file_path(file_path, post_fix_filename='grayscale_mode{}'.format(convert_mode))
     return save_image(pil_image=image, new_file_path=new_file_path)
 
 
+grayscale.image_operation = _grayscale
 grayscale.combo_choices = {'convert_mode': ['L', '1', 'LA']}
 
 
+@traced
+def _color_grayscale(
+    image,
+    color_1: tuple = Colors.black,
+    mid_color: tuple = Colors.gray,
+    color_2: tuple = Colors.white,
+    use_mid_color: bool = False,
+
+    black_point: int = 0,
+    white_point: int = 255,
+    mid_point: int = 127,
+):
+    return ImageOps.colorize(
+        image=image,
+        black=color_1,
+        white=color_2,
+        mid=mid_color if use_mid_color else None,
+        blackpoint=black_point, whitepoint=white_point, midpoint=mid_point)
+
+
+@traced
 def color_grayscale(
     file_path: str,
     color_1: tuple = Colors.black,
@@ -538,25 +966,39 @@ def color_grayscale(
     These parameters must have logical order, such that
     **black_point** <= **mid_point** <= **white_point** (if **mid_color** and use_mid_color is specified).
     """
-    colored_image = ImageOps.colorize(
-        image=Image.open(fp=file_path),
-        black=color_1,
-        white=color_2,
-        mid=mid_color if use_mid_color else None,
-        blackpoint=black_point, whitepoint=white_point, midpoint=mid_point)
+    colored_image = _color_grayscale(
+        open_image(file_path),
+        color_1=color_1,
+        mid_color=mid_color,
+        color_2=color_2,
+        use_mid_color=use_mid_color,
+        black_point=black_point,
+        white_point=white_point,
+        mid_point=mid_point,
+    )
 
     new_file_path = get_new_file_path(file_path, post_fix_filename='colorized')
     return save_image(pil_image=colored_image, new_file_path=new_file_path)
 
 
+color_grayscale.image_operation = _color_grayscale
 color_grayscale.color_parameters = ('color_1', 'mid_color', 'color_2')
 
 
+@traced
+def _solarize(image, threshold: int = 128):
+    return ImageOps.solarize(image=image, threshold=threshold)
+
+
+@traced
 def solarize(file_path: str, threshold: int = 128):
     """
     Invert all pixel values above a threshold.
     """
-    image = ImageOps.solarize(image=Image.open(fp=file_path), threshold=threshold)
+    image = _solarize(open_image(file_path), threshold=threshold)
 
     new_file_path = get_new_file_path(file_path, post_fix_filename='solarized{}'.format(threshold))
     return save_image(pil_image=image, new_file_path=new_file_path)
+
+
+solarize.image_operation = _solarize
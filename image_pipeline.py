@@ -0,0 +1,229 @@
+import inspect
+import io
+import os
+import queue
+import threading
+from time import perf_counter
+
+from PIL import Image
+
+from helpers import save_image, get_new_file_path, encode_image, determine_new_file_path, open_image
+
+_DONE = object()  # put in a queue when there are no more items for the next stage
+
+
+class ImagePipeline:
+    """
+    Chain several image operations on one image in memory.
+
+    Every public image operation in image_operations.py that works on a single file has an 'image_operation'
+    attribute: the same operation, but taking and returning a PIL image instead of a file path. The pipeline
+    opens (and decodes) the file once, applies all the steps on the PIL image, and saves only the final result.
+    This saves the intermediate files, and every intermediate lossy jpeg encode.
+
+    Usage:
+        pipeline = ImagePipeline()
+        pipeline.add(resize_image, new_width=2000, new_height=0)
+        pipeline.add(add_margin, margin=50, background_color=Colors.white)
+        pipeline.add(solarize, threshold=100)
+        new_file_path = pipeline.run('/path/to/image.jpeg')
+
+    The parameters for every step are the same as for the file operation itself (minus the 'file_path'), so the
+    'combo_choices' and 'color_parameters' of that operation apply to the step as well.
+    """
+    def __init__(self):
+        self.steps = []
+
+    def add(self, operation, **params):
+        """
+        Add a step. Validate the parameters right away, so a typo fails before any image is opened.
+        """
+        image_operation = getattr(operation, 'image_operation', None)
+        if image_operation is None:
+            raise ValueError('{} can not be used in a pipeline'.format(operation.__name__))
+
+        # bind to a placeholder for the image, raises a TypeError for unknown or missing parameters
+        inspect.signature(image_operation).bind(None, **params)
+
+        self.steps.append((operation, params))
+        return self
+
+    def get_post_fix_filename(self):
+        return '_'.join(operation.__name__ for operation, params in self.steps)
+
+    def apply(self, image):
+        """
+        Apply all steps on the PIL image. Some operations do nothing for invalid parameters (like resize_image
+        with a width and height of 0), in that case the pipeline stops and returns None.
+        """
+        for operation, params in self.steps:
+            image = operation.image_operation(image, **params)
+            if image is None:
+                return
+
+        return image
+
+    def run(self, file_path: str):
+        original_image = open_image(file_path)
+
+        image = self.apply(original_image)
+        if image is None:
+            return
+
+        new_file_path = get_new_file_path(file_path, post_fix_filename=self.get_post_fix_filename())
+        return save_image(pil_image=image, new_file_path=new_file_path, image_format=original_image.format)
+
+
+class StageCounter:
+    """
+    The number of items and bytes that passed a stage, and the time the stage was busy with them (summed over
+    all threads of the stage, so it can be larger than the wall time).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def add(self, seconds: float, number_of_bytes: int = 0):
+        with self.lock:
+            self.items += 1
+            self.bytes += number_of_bytes
+            self.seconds += seconds
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'items': self.items,
+                'bytes': self.bytes,
+                'seconds': self.seconds,
+                'items_per_second': self.items / self.seconds if self.seconds else 0.0,
+            }
+
+
+class StagedPipeline:
+    """
+    Run an ImagePipeline over many files, with reading, decoding, transforming, encoding and writing overlapped:
+
+    - the calling thread reads the files (the raw bytes), one after the other
+    - a pool of 'transform_workers' threads decodes the images and applies the pipeline
+    - a pool of 'write_workers' threads encodes the results and writes them
+
+    The stages are connected by queues of at most 'queue_size' items, which limits the number of images in memory.
+    When the storage is slow (like a network file system), the disk and the CPU are busy at the same time, instead of
+    one waiting for the other. Pillow releases the GIL while decoding, filtering and encoding, so threads are enough.
+
+    Any single file operation with an 'image_operation' can be the transform:
+        staged_pipeline = StagedPipeline(ImagePipeline().add(resize_image, new_width=2000, new_height=0))
+        new_file_paths, errors = staged_pipeline.run(file_paths)
+        print(staged_pipeline.get_statistics())
+    """
+    def __init__(self, pipeline: ImagePipeline, queue_size: int = 8, transform_workers: int = None,
+                 write_workers: int = 2):
+        self.pipeline = pipeline
+        self.queue_size = queue_size
+        self.transform_workers = transform_workers or os.cpu_count() or 1
+        self.write_workers = write_workers
+        self.counters = {}
+
+    def get_statistics(self):
+        return {stage: counter.as_dict() for stage, counter in self.counters.items()}
+
+    def _read(self, file_paths: list, read_queue, errors: dict):
+        for file_path in file_paths:
+            start = perf_counter()
+            try:
+                with open(file_path, 'rb') as file:
+                    data = file.read()
+            except Exception as error:
+                errors[file_path] = '{}: {}'.format(type(error).__name__, error)
+                continue
+
+            self.counters['read'].add(perf_counter() - start, number_of_bytes=len(data))
+            read_queue.put((file_path, data))
+
+        for _ in range(self.transform_workers):
+            read_queue.put(_DONE)
+
+    def _transform(self, read_queue, write_queue, errors: dict):
+        while True:
+            item = read_queue.get()
+            if item is _DONE:
+                return
+
+            file_path, data = item
+            start = perf_counter()
+            try:
+                original_image = Image.open(io.BytesIO(data))
+                image = self.pipeline.apply(original_image)
+            except Exception as error:
+                errors[file_path] = '{}: {}'.format(type(error).__name__, error)
+                continue
+
+            self.counters['transform'].add(perf_counter() - start)
+            if image is not None:
+                write_queue.put((file_path, image, original_image.format))
+
+    def _write(self, write_queue, new_file_paths: dict, errors: dict, path_lock):
+        post_fix_filename = self.pipeline.get_post_fix_filename()
+        while True:
+            item = write_queue.get()
+            if item is _DONE:
+                return
+
+            file_path, image, image_format = item
+            try:
+                start = perf_counter()
+                data = encode_image(image, image_format=image_format)
+                self.counters['encode'].add(perf_counter() - start)
+
+                start = perf_counter()
+                new_file_path = get_new_file_path(file_path, post_fix_filename=post_fix_filename)
+                with path_lock:
+                    # like save_image, never overwrite. 'x' creates the file, so another writer picks another name
+                    if os.path.exists(new_file_path):
+                        new_file_path = determine_new_file_path(new_file_path)
+                    new_file = open(new_file_path, 'xb')
+                with new_file:
+                    new_file.write(data)
+                self.counters['write'].add(perf_counter() - start, number_of_bytes=len(data))
+            except Exception as error:
+                errors[file_path] = '{}: {}'.format(type(error).__name__, error)
+                continue
+
+            new_file_paths[file_path] = new_file_path
+
+    def run(self, file_paths: list):
+        """
+        Return a tuple (new_file_paths, errors), like run_batch:
+        - new_file_paths: in the order of file_paths, None for files that failed or where the pipeline returned None
+        - errors: a dictionary {file_path: error message}
+        """
+        self.counters = {stage: StageCounter() for stage in ('read', 'transform', 'encode', 'write')}
+        read_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        new_file_paths = {}
+        errors = {}
+        path_lock = threading.Lock()
+
+        transform_threads = [
+            threading.Thread(target=self._transform, args=(read_queue, write_queue, errors))
+            for _ in range(self.transform_workers)
+        ]
+        write_threads = [
+            threading.Thread(target=self._write, args=(write_queue, new_file_paths, errors, path_lock))
+            for _ in range(self.write_workers)
+        ]
+        for thread in transform_threads + write_threads:
+            thread.start()
+
+        self._read(file_paths, read_queue, errors)
+
+        for thread in transform_threads:
+            thread.join()
+        for _ in write_threads:
+            write_queue.put(_DONE)
+        for thread in write_threads:
+            thread.join()
+
+        return [new_file_paths.get(file_path) for file_path in file_paths], errors
@@ -0,0 +1,226 @@
+import contextlib
+import inspect
+import json
+import os
+import re
+import shutil
+from hashlib import blake2b
+from time import time
+
+import PIL
+
+from duplicate_files import hash_file
+from helpers import copy_file, determine_new_file_path, split_file_path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no locking of the index on Windows
+
+# change this when the output of operations changes because of a change outside their module (like in helpers.py)
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'python_file_operations')
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3  # 2 GB
+INDEX_FILE_NAME = 'index.json'
+
+
+_source_hashes = {}  # {module file path: hash}, per process
+
+
+def _hash_source(operation):
+    source_path = inspect.getsourcefile(inspect.unwrap(operation))
+    if source_path not in _source_hashes:
+        _source_hashes[source_path] = hash_file(source_path)
+    return _source_hashes[source_path]
+
+
+class ResultCache:
+    """
+    Store the output files of operations, so running the same operation with the same parameters on the same
+    input does not compute it again, but copies the stored output (as a reflink when possible). The stored output
+    is never a hardlink of an output file, so changing an output in place (like patch_tiff_tags does) can not
+    change the cache.
+
+    Operations that return a list of output paths (like crop_image_in_equal_parts) are stored with all their
+    outputs, and return the list again.
+
+    The key of a result is a hash of:
+    - the content of the input file (so renaming or moving it does not matter, changing it does)
+    - the name of the operation, and all its parameters (including the defaults)
+    - a hash of the source of the module of the operation, so a changed operation does not return old results
+    - the transform backend, for operations with a 'transform_backend' attribute (like rotate_image, that uses
+      jpegtran when it is installed, and Pillow otherwise)
+    - the version of this cache and of Pillow
+
+    When the total size of the stored results exceeds 'max_size' bytes, the least recently used results are removed.
+    The number of hits and misses is kept, see statistics().
+
+    Operations can have a 'cacheable' attribute: a function that takes the parameters, and returns False when the
+    result can not be reused (like apply_filter with a random filter).
+    """
+    def __init__(self, cache_directory: str = DEFAULT_CACHE_DIRECTORY, max_size: int = DEFAULT_MAX_SIZE):
+        self.cache_directory = cache_directory
+        self.max_size = max_size
+        self.objects_directory = os.path.join(cache_directory, 'objects')
+        self.index_path = os.path.join(cache_directory, INDEX_FILE_NAME)
+        os.makedirs(self.objects_directory, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked_index(self):
+        """
+        Load the index, and save it afterwards. The index is locked in the meantime, so several processes
+        (like the workers of run_batch) can use the same cache.
+        """
+        with open(os.path.join(self.cache_directory, '.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            index = {'entries': {}, 'hits': 0, 'misses': 0}
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as index_file:
+                    index = json.load(index_file)
+
+            yield index
+
+            temporary_path = '{}.tmp'.format(self.index_path)
+            with open(temporary_path, 'w') as index_file:
+                json.dump(index, index_file)
+            os.replace(temporary_path, self.index_path)
+
+    @staticmethod
+    def _get_all_params(operation, file_path: str, params: dict):
+        bound_arguments = inspect.signature(operation).bind(file_path, **params)
+        bound_arguments.apply_defaults()
+        all_params = dict(bound_arguments.arguments)
+        all_params.pop(next(iter(all_params)))  # the file path, the content is used instead
+        return all_params
+
+    def get_key(self, operation, file_path: str, params: dict):
+        all_params = self._get_all_params(operation, file_path, params)
+        key_data = json.dumps([
+            hash_file(file_path),
+            '{}.{}'.format(operation.__module__, operation.__qualname__),
+            sorted(all_params.items()),
+            _hash_source(operation),
+            getattr(operation, 'transform_backend', lambda: None)(),
+            CACHE_VERSION,
+            PIL.__version__,
+        ], default=str)
+        return blake2b(key_data.encode('utf-8')).hexdigest(), all_params
+
+    def _get_destination(self, file_path: str, name_suffix: str):
+        directory, file_name, extension = split_file_path(file_path)
+        return os.path.join(directory, '{}{}'.format(file_name, name_suffix))
+
+    def _get_object_paths(self, key: str, number_of_outputs: int):
+        # the outputs of one result are stored in a directory per key
+        return [os.path.join(self.objects_directory, key, str(index)) for index in range(number_of_outputs)]
+
+    def _remove_objects(self, key: str):
+        object_path = os.path.join(self.objects_directory, key)
+        if os.path.isdir(object_path):
+            shutil.rmtree(object_path)
+        elif os.path.exists(object_path):
+            os.unlink(object_path)  # stored by an older version of the cache
+
+    def run(self, operation, file_path: str, **params):
+        """
+        Return the output path (or the list of output paths) of operation(file_path, **params), from the cache
+        when possible.
+        """
+        cacheable = getattr(operation, 'cacheable', None)
+        if cacheable is not None and not cacheable(self._get_all_params(operation, file_path, params)):
+            return operation(file_path, **params)
+
+        key, all_params = self.get_key(operation, file_path, params)
+
+        with self._locked_index() as index:
+            entry = index['entries'].get(key)
+            if entry is not None:
+                object_paths = self._get_object_paths(key, len(entry['name_suffixes']))
+                if all(os.path.exists(object_path) for object_path in object_paths):
+                    index['hits'] += 1
+                    entry['last_used'] = time()
+                    destinations = [
+                        self._restore(object_path, self._get_destination(file_path, name_suffix))
+                        for object_path, name_suffix in zip(object_paths, entry['name_suffixes'])
+                    ]
+                    return destinations if entry['is_list'] else destinations[0]
+
+            index['misses'] += 1
+
+        result = operation(file_path, **params)
+        is_list = isinstance(result, (list, tuple))
+        new_file_paths = list(result) if is_list else [result]
+        if not new_file_paths or any(not isinstance(path, str) for path in new_file_paths):
+            return result  # no output files (like None), nothing to store
+
+        # store the names of the outputs relative to the input name, like '_resized.jpeg'. Leave out the (0), (1)
+        # that save_image adds when the file exists.
+        directory, file_name, extension = split_file_path(file_path)
+        name_suffixes = []
+        for new_file_path in new_file_paths:
+            output_name = re.sub(r'\(\d+\)(?=\.[^.]*$)', '', os.path.basename(new_file_path))
+            name_suffixes.append(
+                output_name[len(file_name):] if output_name.startswith(file_name) else '_' + output_name)
+
+        with self._locked_index() as index:
+            self._remove_objects(key)
+            object_paths = self._get_object_paths(key, len(new_file_paths))
+            os.makedirs(os.path.dirname(object_paths[0]))
+            for new_file_path, object_path in zip(new_file_paths, object_paths):
+                # a real copy, a hardlink would be changed together with the output
+                copy_file(new_file_path, object_path)
+
+            index['entries'][key] = {
+                'name_suffixes': name_suffixes,
+                'is_list': is_list,
+                'size': sum(os.path.getsize(object_path) for object_path in object_paths),
+                'last_used': time(),
+            }
+            self._evict(index)
+
+        return result
+
+    def _restore(self, object_path: str, destination: str):
+        if os.path.exists(destination):
+            if hash_file(object_path) == hash_file(destination):
+                # the result is already there, do not make another (0), (1) copy of it
+                return destination
+            destination = determine_new_file_path(destination)
+
+        copy_file(object_path, destination)
+        return destination
+
+    def _evict(self, index: dict):
+        entries = index['entries']
+        total_size = sum(entry['size'] for entry in entries.values())
+
+        for key in sorted(entries, key=lambda entry_key: entries[entry_key]['last_used']):
+            if total_size <= self.max_size:
+                break
+
+            total_size -= entries.pop(key)['size']
+            self._remove_objects(key)
+
+    def statistics(self):
+        with self._locked_index() as index:
+            return {
+                'hits': index['hits'],
+                'misses': index['misses'],
+                'entries': len(index['entries']),
+                'size': sum(entry['size'] for entry in index['entries'].values()),
+            }
+
+    def clear(self):
+        with self._locked_index() as index:
+            for key in index['entries']:
+                self._remove_objects(key)
+            index.update({'entries': {}, 'hits': 0, 'misses': 0})
+
+
+def run_cached(operation, file_path: str, **params):
+    """
+    Run the operation with the default cache (in ~/.cache/python_file_operations).
+    """
+    return ResultCache().run(operation, file_path, **params)
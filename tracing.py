@@ -0,0 +1,194 @@
+"""
+Opt-in tracing of where the time goes in an operation: opening the file, decoding, the transform, encoding and
+writing. Every phase is a span, spans can be nested (the phases of an operation are inside the span of the
+operation), and can have attributes like the number of pixels or bytes.
+
+Usage:
+    import tracing
+    tracing.enable()
+    resize_image('/path/to/image.jpeg', new_width=2000, new_height=0)
+    tracing.export_chrome_trace('trace.json')  # open in chrome://tracing or https://ui.perfetto.dev
+    tracing.print_summary()
+
+Or, without changing any code, set the environment variable PYTHON_FILE_OPERATIONS_TRACE to the path of a trace
+file: tracing is enabled when this module is imported, and the trace is written when the process exits.
+This only traces the current process, not the worker processes of run_batch.
+
+When tracing is disabled (the default), a span is a single check of a global, so it can stay in production code.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+from time import perf_counter_ns
+
+TRACE_ENVIRONMENT_VARIABLE = 'PYTHON_FILE_OPERATIONS_TRACE'
+
+_enabled = False
+_events = []  # (name, thread id, start in ns, duration in ns, depth, attributes)
+_events_lock = threading.Lock()
+_local = threading.local()  # the depth of the current span, per thread
+
+
+class _NoSpan:
+    """
+    Returned by span() when tracing is disabled, all methods do nothing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.depth = getattr(_local, 'depth', 0)
+        _local.depth = self.depth + 1
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        duration = perf_counter_ns() - self.start
+        _local.depth = self.depth
+        if exception_type is not None:
+            self.attributes['error'] = exception_type.__name__
+
+        with _events_lock:
+            _events.append((self.name, threading.get_ident(), self.start, duration, self.depth, self.attributes))
+        return False
+
+    def set(self, **attributes):
+        """
+        Add attributes that are only known during the span, like the size of the encoded image.
+        """
+        self.attributes.update(attributes)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def clear():
+    with _events_lock:
+        del _events[:]
+
+
+def span(name: str, **attributes):
+    """
+    with span('decode', pixels=width * height) as current_span:
+        ...
+        current_span.set(bytes=len(data))
+    """
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name, attributes)
+
+
+def traced(function):
+    """
+    Decorator: the complete call of the function is a span with the name of the function.
+    """
+    @functools.wraps(function)
+    def traced_function(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        with _Span(function.__name__, {}):
+            return function(*args, **kwargs)
+
+    return traced_function
+
+
+def export_chrome_trace(file_path: str):
+    """
+    Write all spans as complete events ('ph': 'X') in the Chrome trace event format.
+    The times are in microseconds, and the spans are grouped per thread.
+    """
+    with _events_lock:
+        events = list(_events)
+
+    trace_events = [{
+        'name': name,
+        'ph': 'X',
+        'ts': start / 1000,
+        'dur': duration / 1000,
+        'pid': os.getpid(),
+        'tid': thread_id,
+        'args': attributes,
+    } for name, thread_id, start, duration, depth, attributes in events]
+
+    with open(file_path, 'w') as trace_file:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, trace_file)
+
+
+def _percentile(sorted_values: list, fraction: float):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize():
+    """
+    Return a dictionary {span name: statistics}, with the count, total, mean, p50, p90, p99 and max durations
+    (in milliseconds), and the totals of the numeric attributes (like pixels and bytes).
+    """
+    with _events_lock:
+        events = list(_events)
+
+    durations = {}
+    totals = {}
+    for name, thread_id, start, duration, depth, attributes in events:
+        durations.setdefault(name, []).append(duration / 1e6)
+        for key, value in attributes.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                totals.setdefault(name, {}).setdefault(key, 0)
+                totals[name][key] += value
+
+    summary = {}
+    for name, values in durations.items():
+        values.sort()
+        summary[name] = {
+            'count': len(values),
+            'total_ms': sum(values),
+            'mean_ms': sum(values) / len(values),
+            'p50_ms': _percentile(values, 0.5),
+            'p90_ms': _percentile(values, 0.9),
+            'p99_ms': _percentile(values, 0.99),
+            'max_ms': values[-1],
+            'totals': totals.get(name, {}),
+        }
+    return summary
+
+
+def print_summary():
+    summary = summarize()
+    print('{:<32} {:>7} {:>11} {:>9} {:>9} {:>9} {:>9}'.format(
+        'span', 'count', 'total ms', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    for name, statistics in sorted(summary.items(), key=lambda item: item[1]['total_ms'], reverse=True):
+        print('{:<32} {:>7} {:>11.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            name, statistics['count'], statistics['total_ms'], statistics['p50_ms'], statistics['p90_ms'],
+            statistics['p99_ms'], statistics['max_ms']))
+
+
+if os.environ.get(TRACE_ENVIRONMENT_VARIABLE):
+    enable()
+    atexit.register(export_chrome_trace, os.environ[TRACE_ENVIRONMENT_VARIABLE])
@@ -1,13 +1,16 @@
+import itertools
 import os
-import subprocess
 import shutil
 import glob
+import tempfile
 
-from helpers import split_file_path
+from ffmpeg_runner import run_ffmpeg, run_ffmpeg_jobs
+from helpers import split_file_path, determine_new_file_path
+from tracing import traced
 
 
-def _make_movie(
-    directory_path: str,
+def _make_movies(
+    directory_paths: list,
     movie_name: str = 'original',
     video_extension: str = 'mp4',
     image_extension: str = 'jpeg',
@@ -17,50 +20,130 @@ def _make_movie(
     codec: str = 'libx264',
     pixel_format: str = 'yuv420p',
     seconds_per_frame=None,
+    segments: int = 1,
+    max_jobs: int = None,
+    on_progress=None,
 ):
     """
     In Nautilus, I like to have two seperate methods available, 'make_movie' and 'make_slideshow'.
     That's why they are spilt up below in two seperate methods.
+
+    A movie is made in every directory, all movies are encoded at the same time (at most 'max_jobs' ffmpeg
+    processes). When 'segments' is greater than 1, the frames of every movie are encoded in that many parts at the
+    same time (see _encode_in_segments).
     """
-    movie_name += '_br{}'.format(bitrate)  # add the bitrate to the movie name
-    video_path = os.path.join(directory_path, '{}.{}'.format(movie_name, video_extension))
-    target_path = os.path.join(directory_path, '*.{}'.format(image_extension))
+    encode_params = dict(frames_per_second=frames_per_second, bitrate=bitrate, codec=codec,
+                         pixel_format=pixel_format, seconds_per_frame=seconds_per_frame)
+    movies = []
+    for directory_path in directory_paths:
+        # add the bitrate to the movie name
+        video_path = os.path.join(directory_path, '{}_br{}.{}'.format(movie_name, bitrate, video_extension))
+        image_file_paths = sorted(glob.glob(os.path.join(directory_path, '*.{}'.format(image_extension))))
 
-    # 3300 works for instagram (but up to 3500 should work. Youtube can be 6000)
-    bitrate_part = '-b:v {}k -bufsize {}k'.format(bitrate, bitrate)
+        if reverse:
+            # ping-pong loop: all frames forward, then backward. The last and first frame are left out of the
+            # backward part, so they are not shown twice when the video loops.
+            image_file_paths = image_file_paths + image_file_paths[-2:0:-1]
+        movies.append((directory_path, image_file_paths, video_path))
 
-    if seconds_per_frame is None:
-        command = "ffmpeg -framerate {} -pattern_type glob -i '{}' {} -c:v {} -pix_fmt {} {}".format(
-            frames_per_second, target_path, bitrate_part, codec, pixel_format, video_path)
+    if segments > 1:
+        _encode_in_segments(
+            [(image_file_paths, video_path) for _, image_file_paths, video_path in movies], segments=segments,
+            max_jobs=max_jobs, on_progress=on_progress, **encode_params)
     else:
-        # generate a slideshow, where each still image will be duplicated frames_per_second * seconds_per_frame times
-        command = "ffmpeg -framerate 1/{} -pattern_type glob -i '{}' {} -c:v {} -r {} -pix_fmt {} {}".format(
-            seconds_per_frame, target_path, bitrate_part, codec, frames_per_second, pixel_format, video_path)
-
-    proc = subprocess.Popen(command, shell=True)
-    proc.wait()
+        run_ffmpeg_jobs([
+            _image_files_job(image_file_paths, video_path, **encode_params)
+            for _, image_file_paths, video_path in movies
+        ], max_jobs=max_jobs, on_progress=on_progress)
 
     #
-    # if desired, make a video in reverse, then add the original and the merged one together.
+    # move the stills to a sub folder 'stills' (only when all movies are made, so a failed movie can be made again)
     #
-    if reverse:
-        reversed_video_path = os.path.join(directory_path, '{}_reversed.{}'.format(movie_name, video_extension))
-        command = 'ffmpeg -i {} {} -vf reverse {}'.format(video_path, bitrate_part, reversed_video_path)
-        proc = subprocess.Popen(command, shell=True)
-        proc.wait()
+    for directory_path, _, _ in movies:
+        separate_stills_folder = os.path.join(directory_path, 'stills')
+        os.mkdir(separate_stills_folder)
 
-        merge_videos(file_paths=[video_path, reversed_video_path], final_video_name='{}_final'.format(movie_name))
+        for image_file in glob.glob(os.path.join(directory_path, '*.{}'.format(image_extension))):
+            shutil.move(image_file, separate_stills_folder)
 
-    #
-    # move the stills to a sub folder 'stills'
-    #
-    separate_stills_folder = os.path.join(directory_path, 'stills')
-    os.mkdir(separate_stills_folder)
+    return [video_path for _, _, video_path in movies]
+
+
+def _read_files(file_paths: list):
+    for file_path in file_paths:
+        with open(file_path, 'rb') as file:
+            yield file.read()
+
+
+def _image_files_job(
+    image_file_paths: list,
+    video_path: str,
+    frames_per_second: int = 30,
+    bitrate: int = 3300,
+    codec: str = 'libx264',
+    pixel_format: str = 'yuv420p',
+    seconds_per_frame=None,
+):
+    """
+    The ffmpeg job (the keyword arguments of FfmpegRunner.run) that encodes the image files in the given order.
+    The files are not decoded in Python, their bytes are piped to ffmpeg as they are (image2pipe), so any list of
+    files can be used, not only the ones matching a glob pattern.
+    """
+    if seconds_per_frame is None:
+        input_arguments = ['-framerate', str(frames_per_second)]
+        output_arguments = []
+        total_frames = len(image_file_paths)
+    else:
+        input_arguments = ['-framerate', '1/{}'.format(seconds_per_frame)]
+        output_arguments = ['-r', str(frames_per_second)]
+        total_frames = int(len(image_file_paths) * seconds_per_frame * frames_per_second)
+
+    arguments = ['-f', 'image2pipe'] + input_arguments + ['-i', '-'] + _get_bitrate_arguments(bitrate) + [
+        '-c:v', codec, '-flags', '+cgop'] + output_arguments + ['-pix_fmt', pixel_format, video_path]
+
+    return dict(arguments=arguments, input_chunks=_read_files(image_file_paths), total_frames=total_frames,
+                output_path=video_path)
+
+
+@traced
+def _encode_in_segments(movies: list, segments: int, max_jobs: int = None, on_progress=None, **encode_params):
+    """
+    One ffmpeg (x264) process does not use all cores of a large machine. Split the frames of every movie (a tuple
+    of the image file paths and the video path) in 'segments' contiguous parts, and encode all parts of all movies
+    at the same time, at most 'max_jobs' ffmpeg processes. Every part starts with a key frame and only has closed
+    GOPs, so the parts can be joined without encoding again (concat demuxer).
+
+    The parts are stored in a temporary directory next to the video file, which is removed afterwards.
+    """
+    temporary_directories = []
+    try:
+        jobs = []
+        segment_video_paths = []
+        for image_file_paths, video_path in movies:
+            segment_length = max(1, -(-len(image_file_paths) // segments))  # round up
+            extension = split_file_path(video_path)[2]
+            temporary_directory = tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(video_path) or None)
+            temporary_directories.append(temporary_directory)
+
+            paths = []
+            for number, index in enumerate(range(0, len(image_file_paths), segment_length)):
+                segment_video_path = os.path.join(temporary_directory, '{:05d}.{}'.format(number, extension))
+                jobs.append(_image_files_job(
+                    image_file_paths[index:index + segment_length], segment_video_path, **encode_params))
+                paths.append(segment_video_path)
+            segment_video_paths.append(paths)
 
-    for image_file in glob.glob(os.path.join(directory_path, '*.{}'.format(image_extension))):
-        shutil.move(image_file, separate_stills_folder)
+        run_ffmpeg_jobs(jobs, max_jobs=max_jobs, on_progress=on_progress)
 
+        # joining only copies the streams, that is fast compared to encoding
+        for paths, (_, video_path) in zip(segment_video_paths, movies):
+            _concat_videos(paths, final_video_path=video_path)
+    finally:
+        for temporary_directory in temporary_directories:
+            shutil.rmtree(temporary_directory)
 
+
+@traced
 def make_movie(
     directory_path: str,
     movie_name: str = 'original',
@@ -71,21 +154,27 @@ def make_movie(
     frames_per_second: int = 30,
     codec: str = 'libx264',
     pixel_format: str = 'yuv420p',
+    segments: int = 1,
 ):
     """
     Use ffmpeg to make a movie from all the files in the given 'directory_path' that have the given 'image_extension'
-    The image files will be places in a new sub folder 'stills'. The 'directory_path' will contain the movie file, and
-    if 'reverse' was checked, a second reversed movie file will be created and a third movie file where the original
-    and the reversed are merged into one file (this results in a looping video, start and end frame are equal).
+    The image files will be places in a new sub folder 'stills'. The 'directory_path' will contain the movie file.
+    If 'reverse' was checked, the movie plays all frames forward and then backward (this results in a looping video).
+    This is done in a single encode, the frames are just provided to ffmpeg in that order.
+
+    Make sure every image in the directory_path has the same dimensions. When this is not the case, ffmpeg fails:
+    FfmpegError is raised with the error of ffmpeg, and the images are not moved.
 
-    Make sure every image in the directory_path has the same dimensions. When this is not the case, the operation
-    will fail without providing any feedback.
+    On machines with many cores, set 'segments' to the number of parts that will be encoded at the same time.
+    The parts are joined without encoding them again.
+    Return the path of the movie file.
     """
-    _make_movie(directory_path=directory_path, movie_name=movie_name, video_extension=video_extension,
+    return _make_movies(directory_paths=[directory_path], movie_name=movie_name, video_extension=video_extension,
                 image_extension=image_extension, reverse=reverse, bitrate=bitrate, frames_per_second=frames_per_second,
-                codec=codec, pixel_format=pixel_format)
+                codec=codec, pixel_format=pixel_format, segments=segments)[0]
 
 
+@traced
 def make_slideshow(
     directory_path: str,
     movie_name: str = 'slideshow',
@@ -97,6 +186,7 @@ def make_slideshow(
     codec: str = 'libx264',
     pixel_format: str = 'yuv420p',
     seconds_per_frame: int = 2,
+    segments: int = 1,
 ):
     """
     Use ffmpeg to make a slideshow from all the files in the given 'directory_path' that have the given
@@ -105,10 +195,43 @@ def make_slideshow(
     Everything will work similar to 'make_movie', except that now, single frames will be shown
     'seconds_per_frame'. So for 30 frames per second and 2 seconds per frame, there will be 60 frames with the
     same image, before continuing with the next image.
+    Return the path of the movie file.
     """
-    _make_movie(directory_path=directory_path, movie_name=movie_name, video_extension=video_extension,
+    return _make_movies(directory_paths=[directory_path], movie_name=movie_name, video_extension=video_extension,
                 image_extension=image_extension, reverse=reverse, bitrate=bitrate, frames_per_second=frames_per_second,
-                codec=codec, pixel_format=pixel_format, seconds_per_frame=seconds_per_frame)
+                codec=codec, pixel_format=pixel_format, seconds_per_frame=seconds_per_frame, segments=segments)[0]
+
+
+@traced
+def make_movies(
+    directory_paths: list,
+    movie_name: str = 'original',
+    video_extension: str = 'mp4',
+    image_extension: str = 'jpeg',
+    reverse: bool = False,
+    bitrate: int = 3300,
+    frames_per_second: int = 30,
+    codec: str = 'libx264',
+    pixel_format: str = 'yuv420p',
+    seconds_per_frame: int = None,
+    segments: int = 1,
+    max_jobs: int = None,
+    on_progress=None,
+):
+    """
+    Like make_movie (or make_slideshow, with 'seconds_per_frame'), for many directories at once: the movies are
+    encoded at the same time, at most 'max_jobs' ffmpeg processes (by default the number of cpus). Many short
+    movies use the whole machine this way, while a single encode of a short movie does not.
+
+    'on_progress' is called with the progress events of ffmpeg, see ffmpeg_runner.
+    Return the list of the movie file paths. When one movie fails, the others are stopped, FfmpegError is raised
+    and no images are moved.
+    """
+    return _make_movies(directory_paths=directory_paths, movie_name=movie_name, video_extension=video_extension,
+                        image_extension=image_extension, reverse=reverse, bitrate=bitrate,
+                        frames_per_second=frames_per_second, codec=codec, pixel_format=pixel_format,
+                        seconds_per_frame=seconds_per_frame, segments=segments, max_jobs=max_jobs,
+                        on_progress=on_progress)
 
 
 movie_combo_choices = {
@@ -125,8 +248,89 @@ movie_combo_choices = {
 }
 make_movie.combo_choices = movie_combo_choices
 make_slideshow.combo_choices = movie_combo_choices
+make_movies.combo_choices = movie_combo_choices
+
+
+def _get_bitrate_arguments(bitrate: int):
+    # 3300 works for instagram (but up to 3500 should work. Youtube can be 6000)
+    return ['-b:v', '{}k'.format(bitrate), '-bufsize', '{}k'.format(bitrate)]
 
 
+def _is_pil_image(frame):
+    # without importing PIL, video_operations does not need it for raw frames
+    return hasattr(frame, 'tobytes') and hasattr(frame, 'mode') and hasattr(frame, 'size')
+
+
+def _frame_to_bytes(frame, frame_size: tuple):
+    """
+    A frame is a PIL image or raw rgb24 bytes (anything that supports the buffer protocol).
+    A raw frame is copied: it waits in the buffer before it is written, and a generator may reuse its buffer for
+    the next frame.
+    """
+    if _is_pil_image(frame):
+        if frame.size != frame_size:
+            raise ValueError('All frames should have the same size {}, got {}'.format(frame_size, frame.size))
+        return frame.convert('RGB').tobytes() if frame.mode != 'RGB' else frame.tobytes()
+
+    frame = memoryview(frame)
+    if frame.nbytes != frame_size[0] * frame_size[1] * 3:
+        raise ValueError('A raw frame of size {} should have {} bytes (rgb24)'.format(
+            frame_size, frame_size[0] * frame_size[1] * 3))
+    return bytes(frame)
+
+
+@traced
+def write_movie_from_frames(
+    frames,
+    video_path: str,
+    frame_size: tuple = None,
+    bitrate: int = 3300,
+    frames_per_second: int = 30,
+    codec: str = 'libx264',
+    pixel_format: str = 'yuv420p',
+    buffer_size: int = 8,
+    timeout: float = None,
+    on_progress=None,
+):
+    """
+    Make a movie from frames that are generated in Python, without saving them as image files first.
+    'frames' is an iterable (like a generator) of PIL images, or of raw rgb24 buffers. For raw buffers,
+    the 'frame_size' (width, height) should be provided, for PIL images it is taken from the first frame.
+
+    The raw pixels are piped to ffmpeg, so no frame is ever encoded as a jpeg and decoded again.
+    The frames are generated in a separate thread, while the frames before them are written to ffmpeg. At most
+    'buffer_size' frames are waiting to be written, when ffmpeg can not keep up, taking the next frame from 'frames'
+    waits. That way the memory use is bounded, no matter how fast the frames are generated.
+
+    When the video_path exists, a unique name will be used. Return the path of the new video file.
+    When ffmpeg fails, or takes longer than 'timeout' seconds, the unfinished video file is removed and the error is
+    raised.
+    """
+    frames = iter(frames)
+    try:
+        first_frame = next(frames)
+    except StopIteration:
+        raise ValueError('No frames to write')
+
+    if frame_size is None:
+        if not _is_pil_image(first_frame):
+            raise ValueError('frame_size is required for raw frames')
+        frame_size = first_frame.size
+
+    if os.path.exists(video_path):
+        video_path = determine_new_file_path(video_path)
+
+    arguments = [
+        '-n', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '{}x{}'.format(*frame_size),
+        '-framerate', str(frames_per_second), '-i', '-',
+    ] + _get_bitrate_arguments(bitrate) + ['-c:v', codec, '-pix_fmt', pixel_format, video_path]
+
+    input_chunks = (_frame_to_bytes(frame, frame_size) for frame in itertools.chain([first_frame], frames))
+    return run_ffmpeg(arguments, input_chunks=input_chunks, output_path=video_path, timeout=timeout,
+                      on_progress=on_progress, buffer_size=buffer_size)
+
+
+@traced
 def merge_videos(file_paths: list, in_alphabetical_order: bool = False, final_video_name: str = 'final'):
     """
     Paste several videos together, and make one final video file.
@@ -134,20 +338,31 @@ def merge_videos(file_paths: list, in_alphabetical_order: bool = False, final_vi
     Otherwise the order of the provided file_paths will be used.
     """
     directory, file_name, extension = split_file_path(file_paths[0])
-    videos_to_merge_file_name = 'videos_to_merge.txt'
 
     if in_alphabetical_order:
         file_paths = sorted(file_paths)
 
-    with open(videos_to_merge_file_name, 'w') as out:
-        text_to_write = '\n'.join(['file {}'.format(video_name) for video_name in file_paths])
-        out.write(text_to_write)
-
     final_video_path = os.path.join(directory, '{}.{}'.format(final_video_name, extension))
-    command = "ffmpeg -safe 0 -f concat -i {} -vcodec copy -acodec copy {}".format(
-        videos_to_merge_file_name, final_video_path)
+    return _concat_videos(file_paths, final_video_path=final_video_path)
 
-    proc = subprocess.Popen(command, shell=True)
-    proc.wait()
 
-    os.unlink(videos_to_merge_file_name)
+@traced
+def _concat_videos(file_paths: list, final_video_path: str):
+    """
+    Join the videos with the ffmpeg concat demuxer, without encoding them again. Return the final video path.
+
+    The list of videos is written to a unique temporary file (so two merges at the same time do not overwrite each
+    others list), with absolute and quoted paths, so file names with spaces or quotes work as well.
+    """
+    file_descriptor, videos_to_merge_file_path = tempfile.mkstemp(prefix='videos_to_merge_', suffix='.txt')
+    try:
+        with os.fdopen(file_descriptor, 'w') as out:
+            for video_path in file_paths:
+                # in the concat file format, a single quote is escaped by closing the quotes: '\''
+                out.write("file '{}'\n".format(os.path.abspath(video_path).replace("'", "'\\''")))
+
+        arguments = ['-safe', '0', '-f', 'concat', '-i', videos_to_merge_file_path,
+                     '-vcodec', 'copy', '-acodec', 'copy', final_video_path]
+        return run_ffmpeg(arguments, output_path=final_video_path)
+    finally:
+        os.unlink(videos_to_merge_file_path)